@@ -0,0 +1,232 @@
+import numpy as np
+
+class AdaptiveFunctionError(Exception):
+  def __init__(self, message, error):
+    super(Exception, self).__init__(message)
+    self.errors = error
+
+def getWFEEvaluator(controller, field_type, wave_number=1, sampling=4,
+                    metric="RMS"):
+  '''
+    Get an evaluator for zCAdaptiveFieldSampler returning the WFE [metric]
+    ("RMS" or "P2V") for a list of fields.
+  '''
+  def evaluate(fields):
+    return [header[metric] for idx, data, header in
+            controller.iterAnalysisWFEForFields(fields, field_type,
+                                                wave_number, sampling)]
+  return evaluate
+
+def getRayTraceEvaluator(controller, field_type, wave_number=1, metric=None):
+  '''
+    Get an evaluator for zCAdaptiveFieldSampler returning [metric] of the
+    chief ray for a list of fields. [metric] is a function of the ray (as
+    returned by doRaytrace) and the field; by default the radial image
+    height.
+  '''
+  if metric is None:
+    metric = lambda ray, field: np.hypot(ray[2], ray[3])
+  def evaluate(fields):
+    return [metric(ray, fields[idx]) for idx, ray in
+            controller.iterRayTraceForFields(fields, field_type, wave_number)]
+  return evaluate
+
+class zCAdaptiveFieldSampler():
+  '''
+    Sample a scalar metric across the field, refining a quadtree of cells
+    only where the metric changes quickly.
+
+    [evaluate] is a function taking a list of fields [(x, y), ..] and
+    returning a list of metric values, e.g. from getWFEEvaluator(). Each
+    round of refinement is evaluated with a single call.
+
+    The field [x_range] x [y_range] is first sampled on a uniform
+    [n_initial] x [n_initial] grid (n_initial >= 3). The interpolation error
+    of each cell is then estimated:
+
+    - for the initial cells, from the second differences of the grid
+      (the error of linear interpolation is ~h^2 f''/8),
+    - for refined cells, from the difference between the samples added at
+      the centre and edge midpoints of the parent and the parent's bilinear
+      interpolation, scaled by 1/4 for the halved cell size.
+
+    Cells with an estimated error above [tolerance] are split, largest error
+    first, until no cell exceeds it, [max_depth] is reached or
+    [max_evaluations] samples have been taken. The initial grid must fit 
+    within [max_evaluations].
+  '''
+  def __init__(self, evaluate, x_range, y_range, tolerance, n_initial=5,
+               max_evaluations=200, max_depth=6):
+    if n_initial < 3:
+      raise AdaptiveFunctionError("At least a 3 x 3 initial grid is " +
+                                  "required.", -1)
+    if n_initial**2 > max_evaluations:
+      raise AdaptiveFunctionError("Initial grid exceeds max_evaluations.",
+                                  -1)
+    self.evaluate = evaluate
+    self.x_range = x_range
+    self.y_range = y_range
+    self.tolerance = tolerance
+    self.n_initial = n_initial
+    self.max_evaluations = max_evaluations
+    self.max_depth = max_depth
+    self.samples = {}
+    self.cells = []   # leaves, (i, j, depth, estimated error)
+
+  def _getCellCorners(self, i, j, depth):
+    '''
+      Get the corners (x0, x1, y0, y1) of cell [i], [j] at [depth].
+    '''
+    n = (self.n_initial-1) * 2**depth
+    dx = float(self.x_range[1]-self.x_range[0])/n
+    dy = float(self.y_range[1]-self.y_range[0])/n
+    return (self.x_range[0]+i*dx, self.x_range[0]+(i+1)*dx,
+            self.y_range[0]+j*dy, self.y_range[0]+(j+1)*dy)
+
+  def _getKey(self, x, y):
+    return (round(x, 12), round(y, 12))
+
+  def _sample(self, fields):
+    '''
+      Evaluate the fields not already sampled in a single call.
+    '''
+    new = []
+    keys = set(self.samples)
+    for x, y in fields:
+      if self._getKey(x, y) not in keys:
+        keys.add(self._getKey(x, y))
+        new.append((x, y))
+    if len(new) == 0:
+      return
+    values = self.evaluate(new)
+    if len(values) != len(new):
+      raise AdaptiveFunctionError("Evaluator returned the wrong number of " +
+                                  "values.", -1)
+    for (x, y), value in zip(new, values):
+      self.samples[self._getKey(x, y)] = float(value)
+
+  def _getValue(self, x, y):
+    return self.samples[self._getKey(x, y)]
+
+  def _getNewFields(self, i, j, depth):
+    '''
+      Get the centre and edge midpoints of a cell.
+    '''
+    x0, x1, y0, y1 = self._getCellCorners(i, j, depth)
+    xm, ym = (x0+x1)/2., (y0+y1)/2.
+    return [(xm, ym), (xm, y0), (xm, y1), (x0, ym), (x1, ym)]
+
+  def _getNumberOfEvaluations(self):
+    return len(self.samples)
+
+  def _initialise(self):
+    n = self.n_initial
+    xs = np.linspace(self.x_range[0], self.x_range[1], n)
+    ys = np.linspace(self.y_range[0], self.y_range[1], n)
+    self._sample([(x, y) for y in ys for x in xs])
+    grid = np.array([[self._getValue(x, y) for x in xs] for y in ys])
+
+    # second differences along each axis, padded at the edges with the
+    # nearest interior value.
+    #
+    d2x = np.abs(grid[:, :-2] - 2*grid[:, 1:-1] + grid[:, 2:])
+    d2x = np.hstack([d2x[:, :1], d2x, d2x[:, -1:]])
+    d2y = np.abs(grid[:-2, :] - 2*grid[1:-1, :] + grid[2:, :])
+    d2y = np.vstack([d2y[:1, :], d2y, d2y[-1:, :]])
+    curvature = np.maximum(d2x, d2y)
+    for j in range(n-1):
+      for i in range(n-1):
+        error = curvature[j:j+2, i:i+2].max()/8.
+        self.cells.append((i, j, 0, error))
+
+  def _refine(self, cells):
+    '''
+      Split [cells], sampling all the new points in a single evaluation.
+    '''
+    fields = []
+    for i, j, depth, error in cells:
+      fields += self._getNewFields(i, j, depth)
+    self._sample(fields)
+
+    for cell in cells:
+      i, j, depth, error = cell
+      self.cells.remove(cell)
+      x0, x1, y0, y1 = self._getCellCorners(i, j, depth)
+      f00, f10 = self._getValue(x0, y0), self._getValue(x1, y0)
+      f01, f11 = self._getValue(x0, y1), self._getValue(x1, y1)
+      bilinear = {(1, 1): (f00+f10+f01+f11)/4., (1, 0): (f00+f10)/2.,
+                  (1, 2): (f01+f11)/2., (0, 1): (f00+f01)/2.,
+                  (2, 1): (f10+f11)/2.}
+      xs = (x0, (x0+x1)/2., x1)
+      ys = (y0, (y0+y1)/2., y1)
+      deviation = {}
+      for (a, b), value in bilinear.items():
+        deviation[(a, b)] = abs(self._getValue(xs[a], ys[b]) - value)
+      for ci in (0, 1):
+        for cj in (0, 1):
+          corners = [(a, b) for a in (ci, ci+1) for b in (cj, cj+1)]
+          this_error = max([deviation.get(c, 0.) for c in corners])/4.
+          self.cells.append((2*i+ci, 2*j+cj, depth+1, this_error))
+
+  def getInterpolant(self):
+    '''
+      Get a function f(x, y) bilinearly interpolating the samples within the
+      leaf cell containing each point. x and y may be arrays.
+    '''
+    max_depth = max([depth for i, j, depth, error in self.cells])
+    n = (self.n_initial-1) * 2**max_depth
+    lookup = np.empty((n, n), dtype=int)
+    corners = np.empty((len(self.cells), 4))
+    values = np.empty((len(self.cells), 4))
+    for idx, (i, j, depth, error) in enumerate(self.cells):
+      scale = 2**(max_depth-depth)
+      lookup[j*scale:(j+1)*scale, i*scale:(i+1)*scale] = idx
+      x0, x1, y0, y1 = self._getCellCorners(i, j, depth)
+      corners[idx] = (x0, x1, y0, y1)
+      values[idx] = (self._getValue(x0, y0), self._getValue(x1, y0),
+                     self._getValue(x0, y1), self._getValue(x1, y1))
+
+    def interpolate(x, y):
+      x = np.asarray(x, dtype=float)
+      y = np.asarray(y, dtype=float)
+      i = ((x-self.x_range[0])/(self.x_range[1]-self.x_range[0])*n)
+      j = ((y-self.y_range[0])/(self.y_range[1]-self.y_range[0])*n)
+      idx = lookup[np.clip(j.astype(int), 0, n-1),
+                   np.clip(i.astype(int), 0, n-1)]
+      x0, x1, y0, y1 = np.rollaxis(corners[idx], -1)
+      f00, f10, f01, f11 = np.rollaxis(values[idx], -1)
+      u = (x-x0)/(x1-x0)
+      v = (y-y0)/(y1-y0)
+      return f00*(1-u)*(1-v) + f10*u*(1-v) + f01*(1-u)*v + f11*u*v
+    return interpolate
+
+  def getSamples(self):
+    '''
+      Get the sampled fields, (n, 2), and their values, (n,).
+    '''
+    keys = sorted(self.samples)
+    return (np.array(keys), np.array([self.samples[k] for k in keys]))
+
+  def run(self):
+    '''
+      Sample and refine until converged or the budget is exhausted.
+
+      Returns the sampled fields and values (see getSamples()) and an
+      interpolant (see getInterpolant()).
+    '''
+    self._initialise()
+    while True:
+      candidates = [cell for cell in self.cells
+                    if cell[3] > self.tolerance and cell[2] < self.max_depth]
+      candidates.sort(key=lambda cell: -cell[3])
+
+      # each split costs at most 5 new samples.
+      #
+      budget = max(0, (self.max_evaluations -
+                       self._getNumberOfEvaluations())/5)
+      candidates = candidates[:budget]
+      if len(candidates) == 0:
+        break
+      self._refine(candidates)
+    fields, values = self.getSamples()
+    return fields, values, self.getInterpolant()
@@ -0,0 +1,206 @@
+'''
+  Run a batch job through Controller/MeritFunction with checkpointing.
+
+  usage: python Batch.py job.json [--restart]
+
+  The job spec is a JSON file, e.g.
+
+    {
+      "lens": "C:\\lenses\\lens.zmx",
+      "fields": [[0, 0], [0, 0.5], [0, 1]],
+      "field_type": 0,
+      "wavelengths": [0.6, 0.7],
+      "sampling": 4,
+      "analyses": ["WFE", "RAY", "MERIT"],
+      "merit_function": {"zpl_path": "C:\\Zemax\\Macros\\",
+                         "zpl_filename": "DEFAULTMERIT.ZPL",
+                         "settings": {"data": 0, "rings": 3}},
+      "store": "job.results",
+      "checkpoint": "job.ckpt"
+    }
+
+  Analyses are WFE maps and chief ray traces for each field and wavelength,
+  and the value of the merit function. Wavelengths are in microns; if
+  omitted, the lens wavelengths are used with wave number 1. Results are
+  written to a zCResultStore at [store] as they are produced, and the
+  checkpoint is rewritten after every completed unit of work (one field of
+  one analysis at one wavelength).
+  Rerunning the same job resumes from the checkpoint, skipping finished
+  work.
+'''
+import argparse
+import hashlib
+import json
+import os
+import time
+
+from Controller import *
+from MeritFunction import *
+from Store import zCResultStore
+
+BATCH_ANALYSES = ("WFE", "RAY", "MERIT")
+
+class BatchFunctionError(Exception):
+  def __init__(self, message, error):
+    super(Exception, self).__init__(message)
+    self.errors = error
+
+class zCBatchJob():
+  '''
+    A checkpointed batch job, see module docstring for the job spec.
+  '''
+  def __init__(self, spec, zmx_link, restart=False):
+    self.spec = spec
+    self.zmx_link = zmx_link
+    self.controller = Controller(zmx_link)
+    for analysis in spec.get("analyses", []):
+      if analysis not in BATCH_ANALYSES:
+        raise BatchFunctionError("Unknown analysis " + str(analysis), -1)
+
+    self.spec_key = hashlib.sha1(json.dumps(spec, sort_keys=True)).hexdigest()
+    self.checkpoint_path = spec.get("checkpoint", "batch.ckpt")
+    self.store_path = spec.get("store", "batch.results")
+    if restart:
+      for path in (self.checkpoint_path, self.store_path):
+        if os.path.exists(path):
+          os.remove(path)
+    self.checkpoint = self._loadCheckpoint()
+
+  def _loadCheckpoint(self):
+    if not os.path.exists(self.checkpoint_path):
+      return {"SPEC_KEY": self.spec_key, "DONE": [], "STAGES": {}}
+    with open(self.checkpoint_path, 'r') as f:
+      checkpoint = json.load(f)
+    if checkpoint["SPEC_KEY"] != self.spec_key:
+      raise BatchFunctionError("Checkpoint is for a different job spec, use " +
+                               "--restart to discard it.", -1)
+    return checkpoint
+
+  def _writeCheckpoint(self):
+    '''
+      Write the checkpoint to a temporary file first, so an interruption
+      never leaves a partially written checkpoint.
+    '''
+    tmp_path = self.checkpoint_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+      json.dump(self.checkpoint, f)
+    if os.path.exists(self.checkpoint_path):
+      os.remove(self.checkpoint_path)
+    os.rename(tmp_path, self.checkpoint_path)
+
+  def _setup(self):
+    '''
+      Load the lens and set up the wavelengths and merit function. This is
+      repeated on every run, as the Zemax state does not persist.
+    '''
+    if not self.controller.isFileAlreadyLoaded(self.spec["lens"]):
+      self.controller.loadZemaxFile(self.spec["lens"])
+    if self.spec.get("wavelengths"):
+      self.controller.setWavelengthNumberOf(len(self.spec["wavelengths"]))
+      for idx, wave in enumerate(self.spec["wavelengths"]):
+        self.controller.setWavelengthValue(wave, idx+1)
+    if self.spec.get("merit_function"):
+      mf_spec = self.spec["merit_function"]
+      mf = MeritFunction(self.zmx_link, self.controller, mf_spec["zpl_path"],
+                         mf_spec["zpl_filename"])
+      mf.createDefaultMF(**mf_spec.get("settings", {}))
+
+  def _runStage(self, stage, units):
+    '''
+      Run the units of work yielded by [units], updating the checkpoint
+      after each one.
+    '''
+    if stage in self.checkpoint["DONE"]:
+      return
+    stats = self.checkpoint["STAGES"].setdefault(stage, {"UNITS": 0,
+                                                         "SECONDS": 0.})
+    start = time.time()
+    for unit in units:
+      now = time.time()
+      stats["UNITS"] += 1
+      stats["SECONDS"] += now-start
+      start = now
+      self._writeCheckpoint()
+    stats["SECONDS"] += time.time()-start
+    self.checkpoint["DONE"].append(stage)
+    self._writeCheckpoint()
+
+  def getSummary(self):
+    '''
+      Get the throughput and time spent per stage as a list of (stage,
+      units, seconds, units per second).
+    '''
+    summary = []
+    for stage in sorted(self.checkpoint["STAGES"]):
+      stats = self.checkpoint["STAGES"][stage]
+      if stats["SECONDS"] > 0:
+        rate = stats["UNITS"]/stats["SECONDS"]
+      else:
+        rate = 0.
+      summary.append((stage, stats["UNITS"], stats["SECONDS"], rate))
+    return summary
+
+  def run(self):
+    '''
+      Run (or resume) the job.
+    '''
+    start = time.time()
+    self._setup()
+    setup = self.checkpoint["STAGES"].setdefault("SETUP", {"UNITS": 0,
+                                                           "SECONDS": 0.})
+    setup["UNITS"] += 1
+    setup["SECONDS"] += time.time()-start
+    self._writeCheckpoint()
+
+    fields = [tuple(f) for f in self.spec.get("fields", [])]
+    field_type = self.spec.get("field_type", 0)
+    sampling = self.spec.get("sampling", 4)
+    n_waves = len(self.spec.get("wavelengths") or [None])
+    store = zCResultStore(self.store_path)
+    try:
+      for analysis in self.spec.get("analyses", []):
+        if analysis == "MERIT":
+          def units():
+            value = self.controller.doOptimise(nCycles=-1)
+            store.put(("MERIT",), value)
+            yield value
+          self._runStage("MERIT", units())
+          continue
+        for wave_number in range(1, n_waves+1):
+          stage = analysis + "/" + str(wave_number)
+          if analysis == "WFE":
+            units = self.controller.iterAnalysisWFEForFields(fields,
+                      field_type, wave_number, sampling, store=store)
+          else:
+            units = self.controller.iterRayTraceForFields(fields,
+                      field_type, wave_number, store=store)
+          self._runStage(stage, units)
+    finally:
+      store.close()
+    return self.getSummary()
+
+def main():
+  parser = argparse.ArgumentParser(description="Run a checkpointed batch " +
+                                   "job through the Zemax controller.")
+  parser.add_argument("spec", help="job spec (JSON)")
+  parser.add_argument("--restart", action="store_true",
+                      help="discard any existing checkpoint and results")
+  args = parser.parse_args()
+
+  with open(args.spec, 'r') as f:
+    spec = json.load(f)
+
+  import pyzdde.zdde as pyz
+  zmx_link = pyz.createLink()
+  try:
+    job = zCBatchJob(spec, zmx_link, restart=args.restart)
+    summary = job.run()
+  finally:
+    zmx_link.close()
+
+  print "%-12s %8s %10s %10s" % ("stage", "units", "seconds", "units/s")
+  for stage, units, seconds, rate in summary:
+    print "%-12s %8d %10.2f %10.2f" % (stage, units, seconds, rate)
+
+if __name__ == "__main__":
+  main()
@@ -9,6 +9,20 @@ class ControllerFunctionError(Exception):
     super(Exception, self).__init__(message)
     self.errors = error
 
+def getSnakeOrder(shape):
+  '''
+    Get the indices of a grid of [shape] in boustrophedon order, i.e. 
+    consecutive indices differ along exactly one axis, and by one step.
+  '''
+  if len(shape) == 0:
+    return [()]
+  inner = getSnakeOrder(shape[1:])
+  order = []
+  for i in range(shape[0]):
+    for rest in (inner if i % 2 == 0 else reversed(inner)):
+      order.append((i,) + rest)
+  return order
+
 class Controller():
   '''
     This class wraps some of the controller functionality from pyZDDE into more 
@@ -41,6 +55,71 @@ class Controller():
     return (cb1, cb2, dummy)
   
   def addTiltAndDecentreAboutPivot(self, firstSurf, lastSurf, pivot_z=0, x_c=0.0, y_c=0.0, x_tilt=0.0, y_tilt=0.0, order=0):
+    '''
+      Add a tilt and decentre (x_c, y_c, x_tilt, y_tilt) about a pivot 
+      [pivot_z] from the front of the lens for surfaces [firstSurf] to 
+      [lastSurf]. See _insertTiltAndDecentreAboutPivot() for details.
+      
+      To add tilts and decentres to several groups of surfaces, use 
+      addTiltsAndDecentresAboutPivots() instead.
+    '''
+    cb1, cb2, dummy = self._insertTiltAndDecentreAboutPivot(firstSurf, lastSurf, 
+                                                            pivot_z, x_c, y_c, 
+                                                            x_tilt, y_tilt, 
+                                                            order)
+    self.zmx_link.zGetUpdate()
+    
+    self.DDEToLDE()
+    return (cb1, cb2, dummy)
+
+  def addTiltsAndDecentresAboutPivots(self, specs):
+    '''
+      Add tilts and decentres about pivots for several groups of surfaces in 
+      one pass.
+      
+      [specs] is a list of tuples with the same arguments as 
+      addTiltAndDecentreAboutPivot(), i.e. 
+      
+        (firstSurf, lastSurf, pivot_z, x_c, y_c, x_tilt, y_tilt, order) 
+      
+      where trailing arguments may be omitted to take their defaults. Surface 
+      numbers are those of the lens before any insertions are made. Groups 
+      must not overlap.
+      
+      Groups are inserted from the back of the lens to the front, so the 
+      surface numbers of a group are still valid when it is inserted; Zemax 
+      renumbers the solves and pickups of groups further back as surfaces are 
+      inserted in front of them. The lens is updated and pushed to the LDE 
+      once at the end.
+      
+      Returns a dictionary of (firstSurf, lastSurf) mapped to the final 
+      (cb1, cb2, dummy) surface numbers.
+    '''
+    specs = sorted(specs, key=lambda spec: spec[0])
+    for this_spec, next_spec in zip(specs[:-1], specs[1:]):
+      if this_spec[1] >= next_spec[0]:
+        raise ControllerFunctionError("Surface groups overlap.", -1)
+    
+    # Each group inserts 4 surfaces (s1, cb1, cb2 and dummy), so the final 
+    # numbering of a group is offset by 4 for every group in front of it.
+    #
+    res = {}
+    for idx, spec in enumerate(specs):
+      firstSurf, lastSurf = spec[0], spec[1]
+      cb1 = firstSurf + (4*idx) + 1
+      cb2 = cb1 + (lastSurf - firstSurf + 1) + 1
+      dummy = cb2 + 1
+      res[(firstSurf, lastSurf)] = (cb1, cb2, dummy)
+      
+    for spec in reversed(specs):
+      self._insertTiltAndDecentreAboutPivot(*spec)
+    
+    self.DDEToLDE()
+    return res
+
+  def _insertTiltAndDecentreAboutPivot(self, firstSurf, lastSurf, pivot_z=0, 
+                                       x_c=0.0, y_c=0.0, x_tilt=0.0, 
+                                       y_tilt=0.0, order=0):
     '''
       A tilt and decentre can be constructed by the following sequence:
       
@@ -174,9 +253,6 @@ class Controller():
     values = [x_c, y_c, x_tilt, y_tilt, 0]
     for par, val in zip(params, values):
         self.zmx_link.zSetSurfaceParameter(surfNum=cb1, param=par, value=val)
-    self.zmx_link.zGetUpdate()
-    
-    self.DDEToLDE()
     return (cb1, cb2, dummy)
   
   def doOptimise(self, nCycles=0):
@@ -184,6 +260,141 @@ class Controller():
                                        timeout=60)
     return mf_value   
   
+  def doParameterSweep(self, axes, fields, field_type, wave_numbers=(1,), 
+                       analysis="WFE", sampling=4, metric="RMS"):
+    '''
+      Evaluate an analysis over a grid of surface thicknesses and/or 
+      coordinate break parameters.
+      
+      [axes] is a list of tuples (surf, parameter, values), where 
+      [parameter] is either "THICK" for the surface thickness or the 
+      parameter number (e.g. 1-4 for coordinate break decentres and tilts, 
+      see setCoordBreak*), and [values] is the list of values to sweep.
+      
+      [analysis] is one of:
+      
+        WFE   the [metric] ("RMS" or "P2V") of the WFE map with [sampling]
+        RAY   the (x, y) image coordinates of the chief ray
+      
+      Returns an array indexed by sweep axes x field x wavelength (x 2 for 
+      RAY). Evaluations that fail are set to NaN.
+      
+      The grid is traversed in boustrophedon order so that only one 
+      parameter is changed between evaluations, and the field table is only 
+      rewritten once per block of 12 fields rather than for every grid 
+      point. Solves on the swept parameters (e.g. a marginal ray height 
+      solve on a thickness), which would overwrite the values set, are made 
+      fixed for the sweep. The swept parameters and their solves are 
+      restored afterwards.
+    '''
+    if analysis not in ("WFE", "RAY"):
+      raise ControllerFunctionError("Unknown analysis type.", -1)
+    if analysis == "WFE" and metric not in ("RMS", "P2V"):
+      raise ControllerFunctionError("Unknown WFE metric.", -1)
+    shape = tuple([len(values) for surf, parameter, values in axes])
+    if analysis == "WFE":
+      res = np.empty(shape + (len(fields), len(wave_numbers)))
+    else:
+      res = np.empty(shape + (len(fields), len(wave_numbers), 2))
+    res.fill(np.nan)
+    
+    def getParameter(surf, parameter):
+      if parameter == "THICK":
+        return self.getSurfaceThickness(surf)
+      return self.zmx_link.zGetSurfaceParameter(surf, parameter)
+    
+    def setParameter(surf, parameter, value):
+      if parameter == "THICK":
+        self.zmx_link.zSetSurfaceData(surf, self.zmx_link.SDAT_THICK, value)
+      else:
+        self.zmx_link.zSetSurfaceParameter(surf, parameter, value)
+    
+    def getSolveCodes(parameter):
+      '''
+        Get the solve code and the fixed and variable solve types of 
+        [parameter], or None if it cannot take a solve.
+      '''
+      if parameter == "THICK":
+        return (self.zmx_link.SOLVE_SPAR_THICK, 
+                self.zmx_link.SOLVE_THICK_FIXED, self.zmx_link.SOLVE_THICK_VAR)
+      code = getattr(self.zmx_link, "SOLVE_SPAR_PAR" + str(parameter), None)
+      if code is None:
+        return None
+      return (code, self.zmx_link.SOLVE_PAR0_FIXED, 
+              self.zmx_link.SOLVE_PAR0_VAR)
+    
+    # group fields into blocks that fit in the field table. For ray traces, 
+    # the table only holds the normalising field.
+    #
+    if analysis == "WFE":
+      blocks = [range(len(fields))[i:i+12] for i in range(0, len(fields), 12)]
+    else:
+      blocks = [range(len(fields))]
+      max_radial_field_xy = fields[np.argmax([np.sqrt((xy[0]**2)+(xy[1]**2)) 
+                                              for xy in fields])]
+      max_radial_field_value = np.sqrt((max_radial_field_xy[0]**2)+ \
+        (max_radial_field_xy[1]**2))
+    
+    order = getSnakeOrder(shape)
+    original = [getParameter(surf, parameter) 
+                for surf, parameter, values in axes]
+    solves = []
+    for surf, parameter, values in axes:
+      codes = getSolveCodes(parameter)
+      if codes is None:
+        continue
+      solve = self.zmx_link.zGetSolve(surf, codes[0])
+      if solve[0] not in codes[1:]:
+        solves.append((surf, codes, solve))
+    current = [None]*len(axes)
+    try:
+      for surf, codes, solve in solves:
+        self.zmx_link.zSetSolve(surf, codes[0], codes[1])
+      for b_idx, block in enumerate(blocks):
+        if analysis == "WFE":
+          self.setFieldsTable([fields[f_idx] for f_idx in block], 
+                              field_type=field_type)
+        else:
+          self.setFieldsTable([(0,0), (max_radial_field_xy[0], 
+                                       max_radial_field_xy[1])], 
+                              field_type=field_type)
+          
+        # traverse the grid backwards on odd blocks so the first point of a 
+        # block is the last point of the previous one.
+        #
+        for g_idx in (order if b_idx % 2 == 0 else reversed(order)):
+          for a_idx, (surf, parameter, values) in enumerate(axes):
+            if current[a_idx] != g_idx[a_idx]:
+              setParameter(surf, parameter, values[g_idx[a_idx]])
+              current[a_idx] = g_idx[a_idx]
+          self.zmx_link.zGetUpdate()
+          
+          for w_idx, wave_number in enumerate(wave_numbers):
+            for n, f_idx in enumerate(block):
+              if analysis == "WFE":
+                wfe = self.getAnalysisWFE(field_number=n+1, 
+                                          wave_number=wave_number, 
+                                          sampling=sampling)
+                if wfe is not False:
+                  res[g_idx + (f_idx, w_idx)] = wfe[1][metric]
+              else:
+                if max_radial_field_value == 0:
+                  this_hx, this_hy = 0, 0
+                else:
+                  this_hx = fields[f_idx][0]/max_radial_field_value
+                  this_hy = fields[f_idx][1]/max_radial_field_value
+                ray = self.doRaytrace(wave_number=wave_number, mode=0, 
+                                      surf=-1, hx=this_hx, hy=this_hy)
+                if ray[0] == 0:
+                  res[g_idx + (f_idx, w_idx)] = ray[2:4]
+    finally:
+      for (surf, parameter, values), value in zip(axes, original):
+        setParameter(surf, parameter, value)
+      for surf, codes, solve in solves:
+        self.zmx_link.zSetSolve(surf, codes[0], *solve)
+      self.DDEToLDE()
+    return res
+
   def doRaytrace(self, wave_number=1, mode=0, surf=-1, hx=0, hy=0, px=0, py=0):
     '''
       wave_number     wavelength number as in the wavelength data editor
@@ -207,43 +418,103 @@ class Controller():
 
       The output is in local coordinates for the surface defined by 
       [surf] in the doRayTrace() call.
+      
+      See iterRayTraceForFields() for a streaming version.
     '''
-    
-    # find the maximum radial field coordinates, required to define hx and hy, 
-    # the normalised field coordinates.
-    #
-    max_radial_field_index = np.argmax([np.sqrt((xy[0]**2)+(xy[1]**2)) 
-                                        for xy in fields]) 
-    max_radial_field_xy = fields[max_radial_field_index]
-    max_radial_field_value = np.sqrt((max_radial_field_xy[0]**2)+ \
-      (max_radial_field_xy[1]**2))
-    
-    # set up a field table with two fields, [0, 0] and [max_radial_field_x, 
-    # max_radial_field_y].
-    #
-    self.setFieldsTable([(0,0), 
-                         (max_radial_field_xy[0], max_radial_field_xy[1])], 
-                        field_type=field_type)
-    
-    # now ray trace each field in [fields] normalised by the 
-    # max_radial_field_value
-    #
-    rays = []
-    for idx, f in enumerate(fields):
-      if max_radial_field_value == 0:
-        this_hx = 0
-        this_hy = 0
-      else:
-        this_hx = f[0]/max_radial_field_value
-        this_hy = f[1]/max_radial_field_value
+    return [ray for idx, ray in self.iterRayTraceForFields(fields, field_type, 
+                                                           wave_number, px, 
+                                                           py)]
 
-      ray = self.doRaytrace(wave_number=wave_number, mode=0, surf=-1, 
-                            hx=this_hx, hy=this_hy, px=px, py=py)
-      rays.append(ray)
-     
-    return rays
+  def _getAnalysis(self, analysis_type, settings, parser, compact=False):
+    '''
+      Run the text analysis [analysis_type] with [settings], a list of 
+      (keyword, value) pairs passed to zModifySettings, and parse the output 
+      with the zCTextOutput subclass [parser].
+      
+      Returns both the data and file header, or False on failure.
+    '''
+    fp_out, fp_out_filename = tempfile.mkstemp(suffix=".test")
+    fp_settings, fp_settings_filename = tempfile.mkstemp(suffix=".CFG")
+    try:
+      try:
+        # this first call generates a settings file that can be modified 
+        # later
+        assert self.zmx_link.zGetTextFile(fp_out_filename, analysis_type, 
+                                          fp_settings_filename, 
+                                          flag=0, timeout=None) == 0
+        for keyword, value in settings:
+          assert self.zmx_link.zModifySettings(fp_settings_filename, 
+                                               keyword, value) == 0
+        assert self.zmx_link.zGetTextFile(fp_out_filename, analysis_type, 
+                                          fp_settings_filename, 
+                                          flag=1, timeout=None) == 0
+      except AssertionError:
+        print "FATAL: Failed to construct " + parser.NAME + " output."
+        return False
+      
+      out_parsed = parser(fp_out_filename, verbose=False, compact=compact)
+      try:
+        assert out_parsed.parse() == True
+      except AssertionError:
+        print "FATAL: Failed to parse " + parser.NAME + " output in Python", 
+        print "data structures."
+        return False  
+      
+      return out_parsed.getData(), out_parsed.getHeader()
+    finally:
+      # the output and settings files are only needed until parsed.
+      #
+      os.close(fp_out)
+      os.close(fp_settings)
+      for filename in (fp_out_filename, fp_settings_filename):
+        if os.path.exists(filename):
+          os.remove(filename)
+
+  def getAnalysisEncircledEnergy(self, field_number=0, wave_number=0, 
+                                 sampling=4, settings=()):
+    '''
+      Returns a parsed diffraction encircled energy table for field 
+      [field_number] and wavelength [wave_number] (0 for all), with pupil 
+      [sampling] as for getAnalysisWFE. Further (keyword, value) pairs for 
+      zModifySettings can be given in [settings].
+      
+      Returns both the data (see zCEncircledEnergy) and file header.
+    '''
+    return self._getAnalysis("Enc", [("ENC_SAMP", sampling), 
+                                     ("ENC_FIELD", field_number), 
+                                     ("ENC_WAVE", wave_number)] + 
+                             list(settings), zCEncircledEnergy)
 
-  def getAnalysisWFE(self, field_number=1, wave_number=1, sampling=4):
+  def getAnalysisMTF(self, field_number=0, wave_number=0, sampling=4, 
+                     max_frequency=0, settings=()):
+    '''
+      Returns a parsed FFT MTF for field [field_number] and wavelength 
+      [wave_number] (0 for all), with pupil [sampling] as for getAnalysisWFE 
+      up to spatial frequency [max_frequency] (0 for the default). Further 
+      (keyword, value) pairs for zModifySettings can be given in [settings].
+      
+      Returns both the data (see zCMtf) and file header.
+    '''
+    return self._getAnalysis("Mtf", [("MTF_SAMP", sampling), 
+                                     ("MTF_FIELD", field_number), 
+                                     ("MTF_WAVE", wave_number), 
+                                     ("MTF_MAXF", max_frequency)] + 
+                             list(settings), zCMtf)
+
+  def getAnalysisSpot(self, field_number=0, wave_number=0, settings=()):
+    '''
+      Returns the parsed spot radii for field [field_number] and wavelength 
+      [wave_number] (0 for all). Further (keyword, value) pairs for 
+      zModifySettings can be given in [settings].
+      
+      Returns both the data (see zCSpot) and file header.
+    '''
+    return self._getAnalysis("Spt", [("SPT_FIELD", field_number), 
+                                     ("SPT_WAVE", wave_number)] + 
+                             list(settings), zCSpot)
+
+  def getAnalysisWFE(self, field_number=1, wave_number=1, sampling=4, 
+                     compact=False):
     '''
       Returns a parsed WFE map for field [field_idx] and wavelength 
       [wave_number] as defined in the wavelength data editor.
@@ -256,71 +527,55 @@ class Controller():
       .
       .
       Returns both the data and file header.
+      
+      If [compact] is True, the data is returned as a zCCompactMap holding 
+      only the in-pupil samples as float32.
     '''
-    fp_wfe, fp_wfe_filename = tempfile.mkstemp(suffix=".test")
-    fp_wfe_settings, fp_wfe_settings_filename = tempfile.mkstemp(suffix=".CFG")
-    try:
-      # this first call generates a settings file that can be modified later
-      assert self.zmx_link.zGetTextFile(fp_wfe_filename, "Wfm", 
-                                        fp_wfe_settings_filename, 
-                                        flag=0, timeout=None) == 0
-      assert self.zmx_link.zModifySettings(fp_wfe_settings_filename, 
-                                          "WFM_SAMP", sampling) == 0
-      assert self.zmx_link.zModifySettings(fp_wfe_settings_filename, 
-                                           "WFM_FIELD", 
-                                          field_number) == 0
-      assert self.zmx_link.zModifySettings(fp_wfe_settings_filename, 
-                                           "WFM_WAVE", 
-                                          wave_number) == 0
-      assert self.zmx_link.zGetTextFile(fp_wfe_filename, "Wfm", 
-                                        fp_wfe_settings_filename, 
-                                        flag=1, timeout=None) == 0
-    except AssertionError:
-      print "FATAL: Failed to construct WFE map."
-      os.close(fp_wfe)
-      os.close(fp_wfe_settings)
-      return False
-    
-    wfe_parsed = zCWFE(fp_wfe_filename, verbose=False)
-    try:
-      assert wfe_parsed.parse() == True
-    except AssertionError:
-      print "FATAL: Failed to parse WFE map in Python data structures."
-      os.close(fp_wfe)
-      os.close(fp_wfe_settings)
-      return False  
-        
-    os.close(fp_wfe)
-    os.close(fp_wfe_settings)
-    
-    return wfe_parsed.getData(), wfe_parsed.getHeader()
+    return self._getAnalysis("Wfm", [("WFM_SAMP", sampling), 
+                                     ("WFM_FIELD", field_number), 
+                                     ("WFM_WAVE", wave_number)], 
+                             zCWFE, compact=compact)
 
   def getAnalysisWFEForFields(self, fields, field_type, wave_number=1, 
-                              sampling=4):
+                              sampling=4, compact=False):
     '''
       Get WFE maps for for fields [fields] of type [field_type] with wavelength 
       [wave_number] as defined in the wavelength data editor.
       
       This routine circumvents the 12 field limitation.
+      
+      If [compact] is True, each map is returned as a zCCompactMap (see 
+      getAnalysisWFE).
+      
+      See iterAnalysisWFEForFields() for a streaming version.
     '''
     
-    # set up one field in the table
-    #
-    self.setFieldsNumberOf(1)
-    self.setFieldType(field_type)
-    
-    # now get the WFE for each field point.
-    #
     WFE_DATA = []
     WFE_HEADERS = []
-    for idx, f in enumerate(fields):
-      self.setFieldValue(f[0], f[1])
-      wfe_data, wfe_headers = self.getAnalysisWFE(sampling=sampling)
+    wfe = self.iterAnalysisWFEForFields(fields, field_type, wave_number, 
+                                        sampling, compact)
+    for idx, wfe_data, wfe_headers in wfe:
       WFE_DATA.append(wfe_data)
       WFE_HEADERS.append(wfe_headers)
      
     return WFE_DATA, WFE_HEADERS
 
+  def getAnalysisZernike(self, field_number=1, wave_number=1, sampling=4, 
+                         n_terms=37, settings=()):
+    '''
+      Returns the parsed Zernike fringe coefficients, up to term [n_terms], 
+      for field [field_number] and wavelength [wave_number], with pupil 
+      [sampling] as for getAnalysisWFE. Further (keyword, value) pairs for 
+      zModifySettings can be given in [settings].
+      
+      Returns both the data (see zCZernike) and file header.
+    '''
+    return self._getAnalysis("Zfr", [("ZFR_SAMP", sampling), 
+                                     ("ZFR_FIELD", field_number), 
+                                     ("ZFR_WAVE", wave_number), 
+                                     ("ZFR_TERM", n_terms)] + 
+                             list(settings), zCZernike)
+
   def getCoordBreakDecentreX(self, surf):
     return self.zmx_link.zGetSurfaceParameter(surf, 1)
   
@@ -339,6 +594,65 @@ class Controller():
   def getLensData(self):
     return self.zmx_link.zGetFirst()
 
+  def getPrescription(self, from_file=True, solves=False):
+    '''
+      Export the whole lens prescription into a Numpy structured array with 
+      one record per surface (see Parser.PRESCRIPTION_DTYPE).
+      
+      If [from_file] is True, the lens is saved to a temporary .ZMX file with 
+      a single DDE call and parsed locally. Otherwise, each value is 
+      requested surface by surface over DDE.
+      
+      If [solves] is True, the thickness solve of each surface is also 
+      retrieved over DDE, at one call per surface, so a prescription from 
+      file then costs N+1 round trips for N surfaces rather than one. 
+      Otherwise THICK_SOLVE and THICK_SOLVE_PARMS are left as 0 (fixed).
+      
+      The result can be compared with diffPrescriptions() or hashed with 
+      getPrescriptionKey().
+    '''
+    if from_file:
+      fp_lens, fp_lens_filename = tempfile.mkstemp(suffix=".ZMX")
+      os.close(fp_lens)
+      try:
+        assert self.zmx_link.zSaveFile(fp_lens_filename) == 0
+        lens_parsed = zCLensFile(fp_lens_filename, verbose=False)
+        assert lens_parsed.parse() == True
+      except AssertionError:
+        raise ControllerFunctionError("Failed to export lens prescription.", 
+                                      -1)
+      finally:
+        os.remove(fp_lens_filename)
+      prescription = lens_parsed.getData()
+    else:
+      n_surfs = self.zmx_link.zGetSystem()[0] + 1
+      prescription = np.zeros(n_surfs, dtype=PRESCRIPTION_DTYPE)
+      for surf in range(n_surfs):
+        row = prescription[surf]
+        row["SURF"] = surf
+        row["TYPE"] = self.zmx_link.zGetSurfaceData(surf, 
+                                                    self.zmx_link.SDAT_TYPE)
+        row["COMMENT"] = self.getSurfaceComment(surf)
+        row["CURV"] = self.zmx_link.zGetSurfaceData(surf, 
+                                                    self.zmx_link.SDAT_CURV)
+        row["THICK"] = self.getSurfaceThickness(surf)
+        row["GLASS"] = self.zmx_link.zGetSurfaceData(surf, 
+                                                     self.zmx_link.SDAT_GLASS)
+        row["PARM"] = [self.zmx_link.zGetSurfaceParameter(surf, par) 
+                       for par in range(1, PRESCRIPTION_N_PARMS+1)]
+    
+    if solves:
+      for row in prescription:
+        solve = self.zmx_link.zGetSolve(int(row["SURF"]), 
+                                        self.zmx_link.SOLVE_SPAR_THICK)
+        row["THICK_SOLVE"] = solve[0]
+        for idx, param in enumerate(solve[1:5]):
+          try:
+            row["THICK_SOLVE_PARMS"][idx] = float(param)
+          except ValueError:    # e.g. a macro name
+            row["THICK_SOLVE_PARMS"][idx] = np.nan
+    return prescription
+
   def getPupilData(self):
     return self.zmx_link.zGetPupil()
 
@@ -360,6 +674,88 @@ class Controller():
     else:
       return False
   
+  def iterAnalysisWFEForFields(self, fields, field_type, wave_number=1, 
+                               sampling=4, compact=False, store=None):
+    '''
+      Generator version of getAnalysisWFEForFields(). Yields (index, data, 
+      header) for each field in [fields] as soon as its WFE map is parsed, 
+      so only one map is held in memory at a time.
+      
+      If [store] (a zCResultStore) is given, each (data, header) is also 
+      written to it under the key ('WFE', index, field_x, field_y, 
+      wave_number, sampling). Fields already in [store] are skipped and not 
+      yielded, so an interrupted run can be resumed.
+    '''
+    
+    # set up one field in the table
+    #
+    self.setFieldsNumberOf(1)
+    self.setFieldType(field_type)
+    
+    # now get the WFE for each field point.
+    #
+    for idx, f in enumerate(fields):
+      key = ('WFE', idx, f[0], f[1], wave_number, sampling)
+      if store is not None and key in store:
+        continue
+      self.setFieldValue(f[0], f[1])
+      wfe = self.getAnalysisWFE(wave_number=wave_number, sampling=sampling, 
+                                compact=compact)
+      if wfe is False:
+        raise ControllerFunctionError("Failed to get WFE map for field " + 
+                                      str(idx), -1)
+      if store is not None:
+        store.put(key, wfe)
+      yield idx, wfe[0], wfe[1]
+
+  def iterRayTraceForFields(self, fields, field_type, wave_number=1, px=0, 
+                            py=0, store=None):
+    '''
+      Generator version of doRayTraceForFields(). Yields (index, ray) for 
+      each field in [fields] as soon as it has been traced.
+      
+      If [store] (a zCResultStore) is given, each ray is also written to it 
+      under the key ('RAY', index, field_x, field_y, wave_number, px, py). 
+      Fields already in [store] are skipped and not yielded, so an 
+      interrupted run can be resumed.
+    '''
+    
+    # find the maximum radial field coordinates, required to define hx and hy, 
+    # the normalised field coordinates.
+    #
+    max_radial_field_index = np.argmax([np.sqrt((xy[0]**2)+(xy[1]**2)) 
+                                        for xy in fields]) 
+    max_radial_field_xy = fields[max_radial_field_index]
+    max_radial_field_value = np.sqrt((max_radial_field_xy[0]**2)+ \
+      (max_radial_field_xy[1]**2))
+    
+    # set up a field table with two fields, [0, 0] and [max_radial_field_x, 
+    # max_radial_field_y].
+    #
+    self.setFieldsTable([(0,0), 
+                         (max_radial_field_xy[0], max_radial_field_xy[1])], 
+                        field_type=field_type)
+    
+    # now ray trace each field in [fields] normalised by the 
+    # max_radial_field_value
+    #
+    for idx, f in enumerate(fields):
+      key = ('RAY', idx, f[0], f[1], wave_number, px, py)
+      if store is not None and key in store:
+        continue
+      if max_radial_field_value == 0:
+        this_hx = 0
+        this_hy = 0
+      else:
+        this_hx = f[0]/max_radial_field_value
+        this_hy = f[1]/max_radial_field_value
+
+      ray = self.doRaytrace(wave_number=wave_number, mode=0, surf=-1, 
+                            hx=this_hx, hy=this_hy, px=px, py=py)
+      if store is not None:
+        store.put(key, ray)
+      yield idx, ray
+
   def loadZemaxFile(self, path):
     if not os.path.exists(path):
       print "ERROR: " + path
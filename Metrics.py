@@ -0,0 +1,187 @@
+import numpy as np
+
+from Parser import zCCompactMap
+
+# Radius/box bin indices keyed by (grid shape, centre), shared by every PSF
+# on the same grid.
+#
+_PSF_BINS = {}
+
+# Number of PSFs processed together; bounds the size of the temporary
+# index arrays used for binning.
+#
+PSF_CHUNK_SIZE = 64
+
+class MetricsFunctionError(Exception):
+  def __init__(self, message, error):
+    super(Exception, self).__init__(message)
+    self.errors = error
+
+def _getPSFBins(shape, centre):
+  '''
+    Get the (cached) bin indices for a grid of [shape] with its centre at
+    pixel [centre] = (row, column), 0 indexed.
+
+    Returns a dictionary of flattened pixel coordinates relative to the
+    centre, the radius bins (ceiling, for encircled energy), the nearest
+    integer radius bins (for radial profiles) and their pixel counts, the
+    exact radius bins (one per distinct pixel radius, for FWHM) with their
+    radii and pixel counts, the box half-width bins (for ensquared energy)
+    and the number of bins that are not clipped by the edge of the grid.
+  '''
+  key = (tuple(shape), tuple(centre))
+  if key not in _PSF_BINS:
+    y, x = np.indices(shape)
+    x = (x - centre[1]).ravel()
+    y = (y - centre[0]).ravel()
+    r = np.hypot(x, y)
+    n_bins = min(centre[0], centre[1], shape[0]-centre[0]-1,
+                 shape[1]-centre[1]-1) + 1
+    r_profile = np.floor(r + 0.5).astype(int)
+
+    # pixels outside the largest unclipped radius share the last exact bin.
+    #
+    r2 = x**2 + y**2
+    r2_exact, r_exact = np.unique(r2, return_inverse=True)
+    n_exact = np.searchsorted(r2_exact, n_bins**2, side='right')
+    r_exact = np.minimum(r_exact, n_exact)
+    _PSF_BINS[key] = {"X": x, "Y": y,
+                      "R_EE": np.minimum(np.ceil(r).astype(int), n_bins),
+                      "R_PROFILE": np.minimum(r_profile, n_bins),
+                      "R_PROFILE_COUNTS": np.bincount(np.minimum(r_profile,
+                                                                 n_bins),
+                                                      minlength=n_bins+1),
+                      "R_EXACT": r_exact,
+                      "R_EXACT_RADII": np.sqrt(r2_exact[:n_exact]),
+                      "R_EXACT_COUNTS": np.bincount(r_exact,
+                                                    minlength=n_exact+1),
+                      "N_EXACT": n_exact,
+                      "BOX": np.minimum(np.maximum(abs(x), abs(y)), n_bins),
+                      "N_BINS": n_bins}
+  return _PSF_BINS[key]
+
+def _binStack(stack, bins, n_bins):
+  '''
+    Sum each image in [stack], (n, n_pixels), into [n_bins] bins with a
+    single bincount.
+  '''
+  n = stack.shape[0]
+  idx = (np.arange(n)[:, np.newaxis]*n_bins + bins[np.newaxis, :]).ravel()
+  return np.bincount(idx, weights=stack.ravel(),
+                     minlength=n*n_bins).reshape(n, n_bins)
+
+def getPSFMetrics(psfs, headers, wfno=None):
+  '''
+    Compute image quality metrics for a stack of PSFs [psfs] (a 3D array, or
+    a list of arrays or zCCompactMap instances) with their corresponding
+    zCFFftPsf [headers].
+
+    The Strehl ratio is estimated from the ratio of the peak to the total
+    energy relative to that of an unobscured, diffraction limited circular
+    pupil with working F/# [wfno] (a scalar or one per PSF, see
+    zCSystemData). It is not computed if [wfno] is None.
+
+    Returns a dictionary of arrays, one row per PSF:
+
+      SPACING           pixel spacing (m)
+      PEAK              peak value
+      TOTAL             total energy
+      CENTROID_X        centroid offset from CENTRE along columns (m)
+      CENTROID_Y        centroid offset from CENTRE along rows (m)
+      FWHM              full width at half maximum of the azimuthally
+                        averaged profile, interpolated between pixel radii
+                        (m)
+      STREHL            Strehl ratio
+      RADIAL_PROFILE    azimuthally averaged profile, per integer pixel radius
+      EE                encircled energy fraction within radius 0, 1, 2 ..
+                        pixels
+      ESE               ensquared energy fraction within a box of width 1, 3,
+                        5 .. pixels
+
+    The curves are truncated to the largest radius that fits in the grid for
+    all PSFs, and padded with NaN where a PSF's grid is smaller.
+  '''
+  n = len(psfs)
+  if n != len(headers):
+    raise MetricsFunctionError("Number of PSFs and headers differ.", -1)
+
+  spacing = np.array([h['DATA_SPACING']*h['DATA_SPACING_EXP']
+                      for h in headers], dtype=float)
+  wave = np.array([h['WAVE']*h['WAVE_EXP'] for h in headers], dtype=float)
+
+  # group PSFs sharing a grid and centre, so they share bins.
+  #
+  groups = {}
+  for idx, psf in enumerate(psfs):
+    if isinstance(psf, zCCompactMap):
+      shape = psf.shape
+    else:
+      shape = np.shape(psf)
+    centre = (headers[idx]['CENTRE'][0]-1, headers[idx]['CENTRE'][1]-1)
+    groups.setdefault((tuple(shape), centre), []).append(idx)
+  n_bins = max([_getPSFBins(shape, centre)["N_BINS"]
+                for shape, centre in groups]) + 1
+
+  res = {"SPACING": spacing}
+  for key in ("PEAK", "TOTAL", "CENTROID_X", "CENTROID_Y", "FWHM"):
+    res[key] = np.empty(n)
+  for key in ("RADIAL_PROFILE", "EE", "ESE"):
+    res[key] = np.empty((n, n_bins))
+    res[key].fill(np.nan)
+
+  for (shape, centre), indexes in groups.items():
+    bins = _getPSFBins(shape, centre)
+    this_n_bins = bins["N_BINS"]
+    for i in range(0, len(indexes), PSF_CHUNK_SIZE):
+      chunk = indexes[i:i+PSF_CHUNK_SIZE]
+      stack = np.empty((len(chunk), shape[0]*shape[1]))
+      for j, idx in enumerate(chunk):
+        if isinstance(psfs[idx], zCCompactMap):
+          stack[j] = psfs[idx].getData().ravel()
+        else:
+          stack[j] = np.asarray(psfs[idx]).ravel()
+
+      peak = stack.max(axis=1)
+      total = stack.sum(axis=1)
+      res["PEAK"][chunk] = peak
+      res["TOTAL"][chunk] = total
+      res["CENTROID_X"][chunk] = np.dot(stack, bins["X"])/total * \
+        spacing[chunk]
+      res["CENTROID_Y"][chunk] = np.dot(stack, bins["Y"])/total * \
+        spacing[chunk]
+
+      # the last bin of each binning holds everything outside the largest
+      # unclipped radius, so is dropped.
+      #
+      ee = np.cumsum(_binStack(stack, bins["R_EE"], this_n_bins+1), axis=1)
+      res["EE"][chunk, :this_n_bins] = ee[:, :-1]/total[:, np.newaxis]
+      ese = np.cumsum(_binStack(stack, bins["BOX"], this_n_bins+1), axis=1)
+      res["ESE"][chunk, :this_n_bins] = ese[:, :-1]/total[:, np.newaxis]
+      profile = _binStack(stack, bins["R_PROFILE"], this_n_bins+1)[:, :-1] / \
+        bins["R_PROFILE_COUNTS"][np.newaxis, :-1]
+      res["RADIAL_PROFILE"][chunk, :this_n_bins] = profile
+
+      # FWHM from the first pixel radius at which the profile drops below
+      # half its maximum, linearly interpolated between radii. Binning by
+      # exact pixel radius, rather than nearest integer radius, keeps this
+      # accurate at a few pixels per FWHM.
+      #
+      n_exact = bins["N_EXACT"]
+      exact = _binStack(stack, bins["R_EXACT"], n_exact+1)[:, :-1] / \
+        bins["R_EXACT_COUNTS"][np.newaxis, :-1]
+      radii = bins["R_EXACT_RADII"]
+      half = exact.max(axis=1)/2.
+      below = exact < half[:, np.newaxis]
+      first = np.argmax(below, axis=1)
+      found = below[np.arange(len(chunk)), first] & (first > 0)
+      first = np.maximum(first, 1)
+      p_in = exact[np.arange(len(chunk)), first-1]
+      p_out = exact[np.arange(len(chunk)), first]
+      radius = radii[first-1] + (p_in-half)/(p_in-p_out) * \
+        (radii[first]-radii[first-1])
+      res["FWHM"][chunk] = np.where(found, 2*radius*spacing[chunk], np.nan)
+
+  if wfno is not None:
+    ideal_peak_fraction = np.pi*spacing**2/(4*(wave*np.asarray(wfno))**2)
+    res["STREHL"] = (res["PEAK"]/res["TOTAL"])/ideal_peak_fraction
+  return res
@@ -1,9 +1,35 @@
 import codecs
+import hashlib
 from decimal import *
 
 import numpy as np
 import pylab as plt
 
+# Cache of pupil masks keyed by sampling. Maps with the same sampling and the
+# same pupil share a single (read-only) mask instance.
+#
+_PUPIL_MASKS = {}
+_PUPIL_MASKS_PER_SAMPLING = 8
+
+# Cache of circular pupil masks keyed by (shape, centre), see getPupilMask.
+#
+_CIRCULAR_PUPIL_MASKS = {}
+
+# Lens prescription, one record per surface.
+#
+PRESCRIPTION_N_PARMS = 12
+PRESCRIPTION_DTYPE = np.dtype([("SURF", "i4"), ("TYPE", "S16"), 
+                               ("COMMENT", "S64"), ("CURV", "f8"), 
+                               ("THICK", "f8"), ("GLASS", "S32"), 
+                               ("PARM", "f8", (PRESCRIPTION_N_PARMS,)), 
+                               ("THICK_SOLVE", "i4"), 
+                               ("THICK_SOLVE_PARMS", "f8", (4,))])
+
+class ParserFunctionError(Exception):
+  def __init__(self, message, error):
+    super(Exception, self).__init__(message)
+    self.errors = error
+
 def decode(fname, encoding):
   '''
     Decode file with given encoding.
@@ -13,264 +39,737 @@ def decode(fname, encoding):
   fp.close()
   return content
 
-class zCFFftPsf():
+# Unit suffixes as written by Zemax, mapped to their exponent. Exponents are
+# kept as strings so they can be converted to float or Decimal.
+#
+UNIT_EXPONENTS = {u'm': '1', u'mm': '1e-3', u'\xb5m': '1e-6', u'nm': '1e-9'}
+
+def getUnitExponent(unit, number_type=float):
   '''
-    Parse a Zemax FFT PSF output file.
+    Get the exponent for [unit] as [number_type], or None if the unit is 
+    unknown.
   '''
-  def __init__(self, fname, verbose=True, debug=False):
+  unit = unicode(unit).rstrip(',.').strip()
+  if unit in UNIT_EXPONENTS:
+    return number_type(UNIT_EXPONENTS[unit])
+  return None
+
+def getNumericBlock(lines, dtype=float):
+  '''
+    Convert whitespace separated numeric [lines] into a 2D array in a 
+    single pass. Blank lines are ignored.
+  '''
+  lines = [line for line in lines if line.strip()]
+  if len(lines) == 0:
+    raise ParserFunctionError("No numeric data found.", -1)
+  values = np.fromstring(u' '.join(lines).encode('ascii', 'replace'), 
+                         dtype=dtype, sep=' ')
+  n_cols = len(lines[0].split())
+  if values.size != len(lines)*n_cols:
+    raise ParserFunctionError("Non-numeric or ragged data found.", -1)
+  return values.reshape(len(lines), n_cols)
+
+def getNumericBlocks(content, min_cols=1):
+  '''
+    Find runs of consecutive lines in [content] consisting only of numbers, 
+    with at least [min_cols] columns.
+    
+    Returns a list of (index of first line, array).
+  '''
+  blocks = []
+  start = None
+  for idx, line in enumerate(content + [u'']):
+    tokens = line.split()
+    numeric = len(tokens) >= min_cols
+    if numeric:
+      try:
+        [float(t) for t in tokens]
+      except ValueError:
+        numeric = False
+    if numeric and start is None:
+      start = idx
+    elif not numeric and start is not None:
+      blocks.append((start, getNumericBlock(content[start:idx])))
+      start = None
+  return blocks
+
+def headerValue(key, token, value_type=float):
+  '''
+    Header spec entry: [token] of the line as [value_type].
+  '''
+  def parse(tokens):
+    return {key: value_type(tokens[token].rstrip(',').strip())}
+  return parse
+
+def headerValueWithUnit(key, token, value_type=float):
+  '''
+    Header spec entry: [token] of the line as [value_type], and the 
+    exponent of the unit that follows it as key_EXP.
+  '''
+  def parse(tokens):
+    return {key: value_type(tokens[token].rstrip(',').strip()), 
+            key + "_EXP": getUnitExponent(tokens[token+1], value_type)}
+  return parse
+
+def headerPair(key, token1, token2, value_type=int):
+  '''
+    Header spec entry: tokens [token1] and [token2] of the line as a tuple.
+  '''
+  def parse(tokens):
+    return {key: (value_type(tokens[token1].rstrip(',').strip()), 
+                  value_type(tokens[token2].rstrip(',').strip()))}
+  return parse
+
+def headerField(token):
+  '''
+    Header spec entry: the field (x, y) starting at [token].
+  '''
+  def parse(tokens):
+    # need the following as Zemax writes a zero X field as a single   
+    # value, but a zero Y field is written still as (X, 0.)
+    try:  
+      return {"FIELD": (float(tokens[token].rstrip(',').strip()), 
+                        float(tokens[token+1].strip()))}
+    except (ValueError, IndexError):
+      return {"FIELD": (0, float(tokens[token].strip()))}
+  return parse
+
+def labelValue(value_type=float):
+  '''
+    Label spec entry: the first token after the label as [value_type].
+  '''
+  def parse(tokens):
+    return value_type(tokens[0])
+  return parse
+
+def labelValues(value_type=float):
+  '''
+    Label spec entry: the tokens after the label, up to the first that is 
+    not a [value_type], as an array.
+  '''
+  def parse(tokens):
+    values = []
+    for t in tokens:
+      try:
+        values.append(value_type(t.rstrip(',')))
+      except ValueError:
+        break
+    return np.array(values)
+  return parse
+
+def findUnit(content, keywords=("Units", "(")):
+  '''
+    Find the unit of the data in [content], as given by e.g. "Units are mm." 
+    or a column label such as "Radius (mm)". Lines containing each of 
+    [keywords] are searched in turn, so by default a "Units" line takes 
+    precedence over other units in parentheses (e.g. of the field). Returns 
+    None if no known unit is found.
+  '''
+  for keyword in keywords:
+    for line in content:
+      if keyword not in line:
+        continue
+      for token in line.replace('(', ' ').replace(')', ' ').split():
+        if getUnitExponent(token) is not None:
+          return unicode(token).rstrip(',.').strip()
+  return None
+
+def _getSharedMask(mask):
+  '''
+    Get the cached instance of [mask], caching it if there is none yet.
+  '''
+  mask = np.asarray(mask, dtype=bool)
+  cached = _PUPIL_MASKS.setdefault(mask.shape, [])
+  for m in cached:
+    if np.array_equal(m, mask):
+      return m
+  mask = mask.copy()
+  mask.flags.writeable = False
+  if len(cached) < _PUPIL_MASKS_PER_SAMPLING:
+    cached.append(mask)
+  return mask
+
+def getPupilMask(shape, centre=None):
+  '''
+    Get the mask of a circular pupil filling a grid of [shape], i.e. a 
+    boolean array that is True for every sample within half the grid size 
+    of [centre] = (row, column), 1 indexed as in the file headers (default: 
+    the Zemax centre, row n/2 + 1, column n/2 + 1).
+
+    Masks are cached per (shape, centre), so maps with the same pupil are 
+    given the same mask instance without it being computed again.
+  '''
+  shape = tuple(shape)
+  if centre is None:
+    centre = (shape[0]/2 + 1, shape[1]/2 + 1)
+  key = (shape, tuple(centre))
+  if key not in _CIRCULAR_PUPIL_MASKS:
+    y, x = np.indices(shape)
+    r2 = ((y - (centre[0]-1)) / (shape[0]/2.))**2 + \
+      ((x - (centre[1]-1)) / (shape[1]/2.))**2
+    _CIRCULAR_PUPIL_MASKS[key] = _getSharedMask(r2 <= 1)
+  return _CIRCULAR_PUPIL_MASKS[key]
+
+def stackCompactMaps(maps):
+  '''
+    Stack a list of zCCompactMap instances into a 2D array of in-pupil
+    samples, (n_maps, n_samples).
+
+    All maps must share the same pupil mask. Returns both the stacked
+    samples and the mask.
+  '''
+  if len(maps) == 0:
+    raise ParserFunctionError("No maps to stack.", -1)
+  mask = maps[0].mask
+  for m in maps:
+    if m.mask is not mask:
+      raise ParserFunctionError("Maps do not share the same pupil mask.", -1)
+  return np.vstack([m.values for m in maps]), mask
+
+def getCompactStatistics(maps):
+  '''
+    Get the mean, RMS (about the mean) and peak-to-valley of the in-pupil
+    samples for each map in a list of zCCompactMap instances.
+
+    Samples that are zero are taken to be outside the pupil, as Zemax 
+    writes zero outside it, e.g. in a central obscuration that the shared 
+    circular mask includes.
+
+    Returns a dictionary of arrays, one entry per map, NaN for maps with no 
+    in-pupil samples. Statistics are computed in a single pass when all 
+    maps share a pupil mask.
+  '''
+  try:
+    values, mask = stackCompactMaps(maps)
+    values = values.astype(np.float64)
+  except ParserFunctionError:
+    # pad the samples of each map with zeros, which are excluded below.
+    #
+    n_samples = max([m.values.size for m in maps] + [0])
+    values = np.zeros((len(maps), n_samples))
+    for idx, m in enumerate(maps):
+      values[idx, :m.values.size] = m.values
+  valid = values != 0
+  n = valid.sum(axis=1).astype(np.float64)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    mean = values.sum(axis=1) / n
+    rms = np.sqrt((np.where(valid, values-mean[:, np.newaxis], 0)**2).sum(
+      axis=1) / n)
+    if values.shape[1] == 0:
+      p2v = np.zeros(len(maps))
+    else:
+      p2v = np.where(valid, values, -np.inf).max(axis=1) - \
+        np.where(valid, values, np.inf).min(axis=1)
+  p2v[n == 0] = np.nan
+  return {"MEAN": mean, "RMS": rms, "P2V": p2v}
+
+def diffPrescriptions(a, b):
+  '''
+    Compare two prescriptions (see PRESCRIPTION_DTYPE) and return the 
+    surface numbers that differ. Surfaces present in only one of the 
+    prescriptions are counted as different.
+  '''
+  n = min(len(a), len(b))
+  differs = np.zeros(n, dtype=bool)
+  for name in PRESCRIPTION_DTYPE.names:
+    this_a, this_b = a[name][:n], b[name][:n]
+    if this_a.dtype.kind == 'f':
+      ne = ~((this_a == this_b) | (np.isnan(this_a) & np.isnan(this_b)))
+    else:
+      ne = this_a != this_b
+    if ne.ndim > 1:
+      ne = ne.any(axis=1)
+    differs |= ne
+  surfs = list(a["SURF"][:n][differs])
+  surfs += list(a["SURF"][n:]) + list(b["SURF"][n:])
+  return np.array(surfs, dtype=int)
+
+def getPrescriptionKey(prescription):
+  '''
+    Get a hash of a prescription (see PRESCRIPTION_DTYPE) suitable for use 
+    as a key when caching results for a given lens state.
+  '''
+  prescription = np.ascontiguousarray(prescription, dtype=PRESCRIPTION_DTYPE)
+  return hashlib.sha1(prescription.tostring()).hexdigest()
+
+class zCCompactMap():
+  '''
+    A compact representation of a map. Only the samples inside [mask] are 
+    kept, as float32, along with a reference to the shared mask.
+
+    [mask] defaults to the whole grid (e.g. for PSFs, which have no pupil). 
+    Any non-zero samples of [data] outside [mask] are added to it, so 
+    packing is never lossy; zero samples inside [mask] are kept.
+  '''
+  def __init__(self, data, dtype=np.float32, mask=None):
+    data = np.asarray(data)
+    if mask is None:
+      mask = np.ones(data.shape, dtype=bool)
+    elif (data[~mask] != 0).any():
+      mask = mask | (data != 0)
+    self.mask = _getSharedMask(mask)
+    self.values = np.asarray(data, dtype=dtype)[self.mask]
+
+  @property
+  def shape(self):
+    return self.mask.shape
+
+  def getData(self):
+    '''
+      Unpack into a full (zero-filled) array.
+    '''
+    data = np.zeros(self.mask.shape, dtype=self.values.dtype)
+    data[self.mask] = self.values
+    return data
+
+class zCTextOutput():
+  '''
+    Base class for parsers of Zemax text analysis output files.
+    
+    Subclasses describe the file declaratively:
+    
+      NAME            name of the output, used in messages.
+      HEADER_SPEC     list of (line index, entry), where entry is a function
+                      taking the tokens of that line and returning a dict of 
+                      header values (see header* functions).
+      LABEL_SPEC      list of (label, key, entry), where entry is a function 
+                      taking the tokens following "label :" on any line and 
+                      returning a header value (see label* functions). The 
+                      label must match exactly, ignoring padding, and the 
+                      first matching line is used.
+      OPTIONAL_KEYS   header keys that do not need to be found.
+      DATA_START      index of the first line of the numeric data block, or 
+                      None if there is none.
+      DATA_SHAPE_KEY  header key holding the expected shape of the data.
+  '''
+  NAME = ""
+  HEADER_SPEC = []
+  LABEL_SPEC = []
+  OPTIONAL_KEYS = ()
+  DATA_START = None
+  DATA_SHAPE_KEY = None
+  ENCODING = "UTF-16-LE"
+  
+  def __init__(self, fname, verbose=True, debug=False, compact=False):
     self.fname = fname
-    self.header = {"WAVE": None, "FIELD": None, "WAVE_EXP": None, 
-                   "DATA_SPACING": None, "DATA_SPACING_EXP": None, 
-                   "DATA_AREA": None, "DATA_AREA_EXP": None, 
-                   "PGRID_SIZE": None, "IGRID_SIZE": None, "CENTRE": None}
+    self.header = dict.fromkeys([key for label, key, entry in 
+                                 self.LABEL_SPEC])
     self.data = None 
     self.verbose = verbose
     self.debug = debug
-          
-  def _parseFileData(self, sampling):
+    self.compact = compact
+    
+  def _parseFileData(self, content):
     '''
       Read file data into a Numpy array.
     '''
-    content = decode(self.fname, "UTF-16-LE")
-    data = []
-    for idx, line in enumerate(content):
-      try:
-        if idx>=18:
-          data.append([float(i.rstrip('\r\n')) for i in line.split('\t')])  
-      except TypeError:		# some non-floatable value has been found
-        return False
-    self.data = np.array(data)
-    if not sampling == self.data.shape:	# not the same as expected sampling
+    if self.compact:
+      dtype = np.float32
+    else:
+      dtype = float
+    try:
+      self.data = getNumericBlock(content[self.DATA_START:], dtype)
+    except ParserFunctionError:   # some non-floatable value has been found
       return False
-    return True     
-
-  def _parseFileHeader(self):
+    if self.DATA_SHAPE_KEY is not None and \
+      not tuple(self.header[self.DATA_SHAPE_KEY]) == self.data.shape:
+      return False                # not the same as expected sampling
+    return True
+  
+  def _parseFileHeader(self, content):
     '''
       Read file header contents into a dict.
     '''
-    content = decode(self.fname, "UTF-16-LE")
-    for idx, line in enumerate(content):
-      if idx == 8:
-        self.header['WAVE'] = float(line.split()[0].strip())
-        if unicode(line.split()[1].rstrip(',').strip()) == u'm':
-          self.header['WAVE_EXP'] = 1
-        if unicode(line.split()[1].rstrip(',').strip()) == u'mm':
-          self.header['WAVE_EXP'] = 1e-3
-        elif unicode(line.split()[1].rstrip(',').strip()) == u'\xb5m':
-          self.header['WAVE_EXP'] = 1e-6
-        elif unicode(line.split()[1].rstrip(',').strip()) == u'nm':
-          self.header['WAVE_EXP'] = 1e-9
-
-        # need the following as Zemax writes a zero X field as a single   
-        # value, but a zero Y field is written still as (X, 0.)
-        try:  
-          self.header['FIELD'] = (float(line.split()[3].rstrip(',').strip()), 
-                                  float(line.split()[4].strip()))
-        except ValueError:
-          self.header['FIELD'] = (0, float(line.split()[3].strip()))
-      elif idx == 9:
-        self.header['DATA_SPACING'] = float(line.split()[3].strip())
-        if unicode(line.split()[4].rstrip('.').strip()) == u'm':
-          self.header['DATA_SPACING_EXP'] = 1
-        if unicode(line.split()[4].rstrip('.').strip()) == u'mm':
-          self.header['DATA_SPACING_EXP'] = 1e-3
-        elif unicode(line.split()[4].rstrip('.').strip()) == u'\xb5m':
-          self.header['DATA_SPACING_EXP'] = 1e-6
-        elif unicode(line.split()[4].rstrip('.').strip()) == u'nm':
-          self.header['DATA_SPACING_EXP'] = 1e-9
-      elif idx == 10:
-        self.header['DATA_AREA'] = float(line.split()[3].strip())
-        if unicode(line.split()[4].strip()) == u'm':
-          self.header['DATA_AREA_EXP'] = 1
-        if unicode(line.split()[4].strip()) == u'mm':
-          self.header['DATA_AREA_EXP'] = 1e-3
-        elif unicode(line.split()[4].strip()) == u'\xb5m':
-          self.header['DATA_AREA_EXP'] = 1e-6
-        elif unicode(line.split()[4].strip()) == u'nm':
-          self.header['DATA_AREA_EXP'] = 1e-9
-      elif idx == 13:
-        self.header['PGRID_SIZE'] = (int(line.split()[3].strip()), 
-                                     int(line.split()[5].strip()))
-      elif idx == 14:
-        self.header['IGRID_SIZE'] = (int(line.split()[3].strip()), 
-                                     int(line.split()[5].strip()))
-      elif idx == 15:
-        self.header['CENTRE'] = (int(line.split()[4].rstrip(',').strip()), 
-                                 int(line.split()[6].strip()))
-        
-      if None in self.header.viewvalues():  # it's fully populated 
+    try:
+      for idx, entry in self.HEADER_SPEC:
+        self.header.update(entry(content[idx].split()))
+    except (IndexError, ValueError, InvalidOperation):
+      return False
+    for line in content:
+      label, sep, value = line.partition(':')
+      if not sep:
+        continue
+      for this_label, key, entry in self.LABEL_SPEC:
+        if label.strip() == this_label and self.header[key] is None:
+          try:
+            self.header[key] = entry(value.split())
+          except (IndexError, ValueError):
+            pass
+    for key, value in self.header.items():
+      if value is None and key not in self.OPTIONAL_KEYS:
         return False
-      return True
+    return True
   
+  def _readFile(self):
+    return decode(self.fname, self.ENCODING)
+
   def getData(self):
-    return np.array(self.data)  
+    if self.compact:
+      return zCCompactMap(self.data)
+    return self.data
   
   def getHeader(self):
     return self.header 
- 
+  
   def parse(self):
-    ''' 
+    '''
       Parse the file fully.
     '''
-    if self._parseFileHeader():
+    content = self._readFile()
+    if self._parseFileHeader(content):
       if self.verbose:
-        print "Successfully parsed ZEMAX FFT PSF output file header."
+        print "Successfully parsed ZEMAX " + self.NAME + " output file header."
       if self.debug:
         print self.header
-      if self._parseFileData(self.header['IGRID_SIZE']):
-        if self.debug:
+      if self.DATA_START is None:
+        return True
+      if self._parseFileData(content):
+        if self.debug and self.DATA_SHAPE_KEY is not None:
           plt.imshow(self.data)
           plt.colorbar()
           plt.show()
         if self.verbose:
-          print "Successfully parsed ZEMAX FFT PSF output file data."
+          print "Successfully parsed ZEMAX " + self.NAME + " output file data."
       else:
-        print "Failed to parse ZEMAX FFT PSF output file data."
+        print "Failed to parse ZEMAX " + self.NAME + " output file data."
         return False
     else:
-      print "Failed to read ZEMAX FFT PSF output file header." 
+      print "Failed to read ZEMAX " + self.NAME + " output file header." 
       return False
-    return True 
- 
-class zCSystemData():
+    return True
+
+class zCEncircledEnergy(zCTextOutput):
   '''
-    Parse a Zemax FFT PSF system data file.
+    Parse a Zemax diffraction encircled energy output file.
+    
+    The data is the largest numeric table, with the radius in the first 
+    column and the fraction of enclosed energy for each curve (including 
+    any diffraction limit) in the remaining columns. The radius unit is 
+    taken from the column labels above the table.
+  '''
+  NAME = "encircled energy"
+  DATA_START = 0
+  
+  def _parseFileData(self, content):
+    '''
+      Read the largest numeric table into a Numpy array.
+    '''
+    blocks = getNumericBlocks(content[self.DATA_START:], min_cols=2)
+    if len(blocks) == 0:
+      return False
+    start, self.data = max(blocks, key=lambda block: block[1].shape[0])
+    labels = [line for line in content[self.DATA_START:start] 
+              if line.strip()][-1:]
+    self.header["RADIUS_UNIT"] = findUnit(labels, ("(",)) or \
+      findUnit(content)
+    self.header["RADIUS_EXP"] = getUnitExponent(self.header["RADIUS_UNIT"])
+    return True
+  
+  def _parseFileHeader(self, content):
+    '''
+      The header is read with the data, as the unit is found from the 
+      table's column labels.
+    '''
+    return True
+  
+  def getData(self):
+    return self.data
+
+class zCFFftPsf(zCTextOutput):
+  '''
+    Parse a Zemax FFT PSF output file.
+  '''
+  NAME = "FFT PSF"
+  HEADER_SPEC = [(8, headerValueWithUnit("WAVE", 0)), 
+                 (8, headerField(3)), 
+                 (9, headerValueWithUnit("DATA_SPACING", 3)), 
+                 (10, headerValueWithUnit("DATA_AREA", 3)), 
+                 (13, headerPair("PGRID_SIZE", 3, 5)), 
+                 (14, headerPair("IGRID_SIZE", 3, 5)), 
+                 (15, headerPair("CENTRE", 4, 6))]
+  DATA_START = 18
+  DATA_SHAPE_KEY = "IGRID_SIZE"
+  
+  def getData(self):
+    if self.compact:
+      return zCCompactMap(self.data)
+    return np.array(self.data)  
+
+class zCLensFile():
+  '''
+    Parse a Zemax lens (.ZMX) file into a prescription.
+    
+    The thickness solve columns are not populated from the file and are 
+    left as 0 (fixed).
   '''
   def __init__(self, fname, verbose=True, debug=False):
     self.fname = fname
-    self.header = {"WFNO": None, "EPD": None}
+    self.data = None
     self.verbose = verbose
     self.debug = debug
     
-    self._parse()
-  
-  def _parseFileHeader(self):
+  def _parseFileData(self):
     '''
-      Read file header contents into a dict.
+      Read the surface data into a Numpy structured array.
     '''
-    content = decode(self.fname, "UTF-16-LE")
-    for idx, line in enumerate(content):
-      if len(line.split(':')) >= 2:
-        if "Working F/#" in line.split(':')[0]:
-          self.header['WFNO'] = float(line.split(':')[1].strip())
-        elif "Entrance Pupil Diameter" in line.split(':')[0]:
-          self.header['EPD'] = float(line.split(':')[1].strip())
-    if None in self.header.viewvalues():		# it's fully populated
+    with open(self.fname, 'rb') as f:
+      raw = f.read()
+    if raw.startswith(codecs.BOM_UTF16_LE):
+      content = raw.decode("UTF-16").splitlines()
+    else:
+      content = raw.decode("latin-1").splitlines()
+    
+    surfs = []
+    this_surf = None
+    for line in content:
+      if not line.strip():
+        continue
+      if not line[0].isspace():   # top level keyword
+        this_surf = None
+        if line.split()[0] == "SURF":
+          this_surf = {"SURF": int(line.split()[1]), "TYPE": "", 
+                       "COMMENT": "", "CURV": 0., "THICK": 0., "GLASS": "", 
+                       "PARM": [0.]*PRESCRIPTION_N_PARMS}
+          surfs.append(this_surf)
+        continue
+      if this_surf is None:
+        continue
+      
+      tokens = line.split()
+      try:
+        if tokens[0] == "TYPE":
+          this_surf["TYPE"] = str(tokens[1])
+        elif tokens[0] == "COMM":
+          this_surf["COMMENT"] = line.strip()[4:].strip().encode("utf-8")
+        elif tokens[0] == "CURV":
+          this_surf["CURV"] = float(tokens[1])
+        elif tokens[0] == "DISZ":
+          if tokens[1] == "INFINITY":
+            this_surf["THICK"] = np.inf
+          else:
+            this_surf["THICK"] = float(tokens[1])
+        elif tokens[0] == "GLAS":
+          this_surf["GLASS"] = str(tokens[1])
+        elif tokens[0] == "PARM":
+          if 0 < int(tokens[1]) <= PRESCRIPTION_N_PARMS:
+            this_surf["PARM"][int(tokens[1])-1] = float(tokens[2])
+      except (IndexError, ValueError):   # malformed line
+        return False
+    
+    if len(surfs) == 0:
       return False
+    self.data = np.zeros(len(surfs), dtype=PRESCRIPTION_DTYPE)
+    for idx, this_surf in enumerate(surfs):
+      for key, value in this_surf.items():
+        self.data[idx][key] = value
     return True
-  
-  def getHeader(self):
-    return self.header
+    
+  def getData(self):
+    return self.data
   
   def parse(self):
-    ''' 
+    '''
       Parse the file fully.
     '''
-    if self._parseFileHeader():
+    if self._parseFileData():
       if self.verbose:
-        print "Successfully parsed ZEMAX system data file header."
+        print "Successfully parsed ZEMAX lens file."
       if self.debug:
-        print self.header
+        print self.data
     else:
-      print "Failed to parse ZEMAX system data file header."
+      print "Failed to parse ZEMAX lens file."
       return False
-    
-class zCWFE():
+    return True
+ 
+class zCMtf(zCTextOutput):
   '''
-    Parse a Zemax wavefront error map.
+    Parse a Zemax FFT MTF output file.
+    
+    The data is an array of (table, spatial frequency, column), where the 
+    columns are the spatial frequency, tangential and sagittal MTF. Each 
+    table belongs to the "Field: x[, y] (unit)" line heading it, if any; 
+    the field of each table is listed in the header as FIELDS (None for a 
+    table with no heading, unless no table has one and there are as many 
+    field lines as tables, when they are taken in order). A table headed 
+    "Diffraction Limit" is put in the header as DIFFRACTION_LIMIT (None if 
+    absent). FREQUENCY_UNIT is one of FREQUENCY_UNITS, or None if the unit 
+    is not recognised.
   '''
-  def __init__(self, fname, verbose=True, debug=False):
-    self.fname = fname
-    self.header = {"WAVE": None, "FIELD": None, "WAVE_EXP": None, "P2V": None, 
-                   "RMS": None, "EXIT_PUPIL_DIAMETER": None, "SAMPLING": None, 
-                   "CENTRE": None}
-    self.data = None 
-    self.verbose = verbose
-    self.debug = debug
-
-  def _parseFileData(self, sampling):
+  NAME = "FFT MTF"
+  DATA_START = 0
+  FREQUENCY_UNITS = {u"mm": u"mm", u"millimeter": u"mm", 
+                     u"millimeters": u"mm", u"mrad": u"mrad", 
+                     u"milliradian": u"mrad", u"milliradians": u"mrad"}
+  
+  def _parseFileData(self, content):
     '''
-      Read file data into a Numpy array.
+      Read the table for each field into a Numpy array.
     '''
-    content = decode(self.fname, "UTF-16-LE")
-    data = []
-    for idx, line in enumerate(content):
-      try:
-        if idx>=16:
-          data.append([float(i.rstrip('\r\n')) for i in line.split('\t')])  
-      except TypeError:		# some non-floatable value has been found
-        return False
-    self.data = np.array(data)
-    if not sampling == self.data.shape:	# not the same as expected sampling
+    tables = []
+    fields = []
+    end = 0
+    for start, block in getNumericBlocks(content, min_cols=2):
+      owners = [section for idx, section in self.sections 
+                if end <= idx < start]
+      end = start + block.shape[0]
+      if len(owners) > 0 and owners[-1] == "DIFFRACTION_LIMIT":
+        self.header["DIFFRACTION_LIMIT"] = block
+      else:
+        tables.append(block)
+        fields.append(owners[-1] if len(owners) > 0 else None)
+    if len(tables) == 0 or len(set([table.shape for table in tables])) != 1:
       return False
-    return True   
+    field_lines = [section for idx, section in self.sections 
+                   if section != "DIFFRACTION_LIMIT"]
+    if fields.count(None) == len(fields) and \
+      len(field_lines) == len(fields):
+      fields = field_lines
+    self.header["FIELDS"] = fields
+    self.data = np.array(tables)
+    return True
+  
+  def _parseFileHeader(self, content):
+    '''
+      Read file header contents into a dict, and find the line index of 
+      each section heading.
+    '''
+    self.sections = []
+    self.header["FREQUENCY_UNIT"] = None
+    self.header["DIFFRACTION_LIMIT"] = None
+    for idx, line in enumerate(content):
+      label, sep, value = line.partition(':')
+      if sep and label.split()[:1] == ["Field"] and len(label.split()) <= 2:
+        this_field = labelValues()(value.split())
+        if len(this_field) > 0:
+          self.sections.append((idx, tuple(this_field)))
+      elif line.strip().lower() == "diffraction limit":
+        self.sections.append((idx, "DIFFRACTION_LIMIT"))
+      elif self.header["FREQUENCY_UNIT"] is None:
+        for keyword in ("cycles per", "cycles/"):
+          if keyword in line.lower():
+            unit = line.lower().split(keyword)[1].split()[:1]
+            unit = [u.rstrip('.,)') for u in unit]
+            if len(unit) > 0 and unit[0] in self.FREQUENCY_UNITS:
+              self.header["FREQUENCY_UNIT"] = \
+                self.FREQUENCY_UNITS[unit[0]]
+            break
+    return True
+  
+  def getData(self):
+    return self.data
+ 
+class zCSpot(zCTextOutput):
+  '''
+    Parse a Zemax spot diagram output file.
     
-  def _parseFileHeader(self):
+    The data is an array of (field, column), where the columns are the RMS 
+    and GEO spot radii. The radius unit is taken from the "Units are" line.
+  '''
+  NAME = "spot diagram"
+  LABEL_SPEC = [("RMS radius", "RMS_RADIUS", labelValues()), 
+                ("GEO radius", "GEO_RADIUS", labelValues())]
+  DATA_START = 0
+  
+  def _parseFileData(self, content):
+    '''
+      Collect the spot radii into a Numpy array.
+    '''
+    if len(self.header["RMS_RADIUS"]) != len(self.header["GEO_RADIUS"]):
+      return False
+    self.data = np.array([self.header["RMS_RADIUS"], 
+                          self.header["GEO_RADIUS"]]).T
+    return True
+  
+  def _parseFileHeader(self, content):
     '''
       Read file header contents into a dict.
     '''
-    content = decode(self.fname, "UTF-16-LE")
-    for idx, line in enumerate(content):
-      if idx == 8:
-        self.header['WAVE'] = Decimal(line.split()[0].strip())
-        if unicode(line.split()[1].rstrip(',').strip()) == u'm':
-          self.header['WAVE_EXP'] = Decimal('1')
-        if unicode(line.split()[1].rstrip(',').strip()) == u'mm':
-          self.header['WAVE_EXP'] = Decimal('1e-3')
-        elif unicode(line.split()[1].rstrip(',').strip()) == u'\xb5m':
-          self.header['WAVE_EXP'] = Decimal('1e-6')
-        elif unicode(line.split()[1].rstrip(',').strip()) == u'nm':
-          self.header['WAVE_EXP'] = Decimal('1e-9')
-
-        # need the following as Zemax writes a zero X field as a single   
-        # value, but a zero Y field is written still as (X, 0.)
-        try:  
-          self.header['FIELD'] = (float(line.split()[3].rstrip(',').strip()), 
-                                  float(line.split()[4].strip()))
-        except ValueError:
-          self.header['FIELD'] = (0, float(line.split()[3].strip()))
-      elif idx == 9:
-        self.header['P2V'] = float(line.split()[4].strip())
-        self.header['RMS'] = float(line.split()[8].strip())
-      elif idx == 11:
-        self.header['EXIT_PUPIL_DIAMETER'] = float(line.split()[3].strip())
-        self.header['EXIT_PUPIL_DIAMETER_UNIT'] = str(line.split()[4].strip())
-      if idx == 13:
-        self.header['SAMPLING'] = (int(line.split()[3].strip()), 
-                                    int(line.split()[5].strip()))
-      if idx == 14:
-        self.header['CENTRE'] = (int(line.split()[4].rstrip(',').strip()), 
-                                  int(line.split()[6].strip()))
-    if None in self.header.viewvalues():		# it's fully populated
+    if not zCTextOutput._parseFileHeader(self, content):
       return False
+    self.header["RADIUS_UNIT"] = findUnit(content, ("Units",))
+    self.header["RADIUS_EXP"] = getUnitExponent(self.header["RADIUS_UNIT"])
     return True
-
+  
   def getData(self):
-   return self.data 
+    return self.data
+    
+class zCSystemData(zCTextOutput):
+  '''
+    Parse a Zemax FFT PSF system data file.
+  '''
+  NAME = "system data"
+  LABEL_SPEC = [("Working F/#", "WFNO", labelValue()), 
+                ("Entrance Pupil Diameter", "EPD", labelValue())]
+  
+  def __init__(self, fname, verbose=True, debug=False):
+    zCTextOutput.__init__(self, fname, verbose, debug)
+    self.parse()
+    
+class zCWFE(zCTextOutput):
+  '''
+    Parse a Zemax wavefront error map.
+  '''
+  NAME = "WFE"
+  HEADER_SPEC = [(8, headerValueWithUnit("WAVE", 0, Decimal)), 
+                 (8, headerField(3)), 
+                 (9, headerValue("P2V", 4)), 
+                 (9, headerValue("RMS", 8)), 
+                 (11, headerValue("EXIT_PUPIL_DIAMETER", 3)), 
+                 (11, headerValue("EXIT_PUPIL_DIAMETER_UNIT", 4, str)), 
+                 (13, headerPair("SAMPLING", 3, 5)), 
+                 (14, headerPair("CENTRE", 4, 6))]
+  DATA_START = 16
+  DATA_SHAPE_KEY = "SAMPLING"
+  
+  def getData(self):
+    '''
+      If compact, the map is packed with the circular pupil given by the 
+      header's SAMPLING and CENTRE (see getPupilMask), so maps at the same 
+      sampling share a mask regardless of any zero samples in the pupil.
+    '''
+    if self.compact:
+      return zCCompactMap(self.data, mask=getPupilMask(
+        self.header["SAMPLING"], self.header["CENTRE"]))
+    return self.data
 
-  def getHeader(self):
-    return self.header 
- 
-  def parse(self):
+class zCZernike(zCTextOutput):
+  '''
+    Parse a Zemax Zernike coefficients output file.
+    
+    The data is an array of the coefficients, starting from term 1. RMS 
+    values are those from integration of the rays, which Zemax lists 
+    before those from the fitted coefficients.
+  '''
+  NAME = "Zernike coefficients"
+  LABEL_SPEC = [("Peak to Valley (to chief)", "P2V_CHIEF", labelValue()), 
+                ("Peak to Valley (to centroid)", "P2V_CENTROID", 
+                 labelValue()), 
+                ("RMS (to chief)", "RMS_CHIEF", labelValue()), 
+                ("RMS (to centroid)", "RMS_CENTROID", labelValue()), 
+                ("Strehl Ratio (Est)", "STREHL", labelValue())]
+  OPTIONAL_KEYS = ("P2V_CHIEF", "P2V_CENTROID", "RMS_CHIEF", "RMS_CENTROID", 
+                   "STREHL")
+  DATA_START = 0
+  
+  def _parseFileData(self, content):
     '''
-      Parse a file fully.
+      Read the coefficients, written as "Z   n   value : ...", into a Numpy 
+      array.
     '''
-    if self._parseFileHeader():
-      if self.verbose:
-        print "Successfully parsed ZEMAX WFE output file header."
-      if self.debug:
-        print self.header
-      if self._parseFileData(self.header['SAMPLING']):
-        if self.debug:
-          plt.imshow(self.data)
-          plt.colorbar()
-          plt.show()
-        if self.verbose:
-          print "Successfully parsed ZEMAX WFE output file data."
-      else:
-        print "Failed to parse ZEMAX WFE output file data."
-        return False
-    else:
-      print "Failed to read ZEMAX WFE output file header." 
+    terms = {}
+    for line in content[self.DATA_START:]:
+      tokens = line.split()
+      if len(tokens) >= 3 and tokens[0] == "Z":
+        try:
+          terms[int(tokens[1])] = float(tokens[2])
+        except ValueError:
+          continue
+    if len(terms) == 0:
       return False
+    self.data = np.zeros(max(terms))
+    for term, value in terms.items():
+      self.data[term-1] = value
     return True
+  
+  def getData(self):
+    return self.data
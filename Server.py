@@ -0,0 +1,450 @@
+'''
+  Serve the Controller and MeritFunction methods over TCP, so that hosts
+  without DDE can drive a Zemax instance remotely.
+
+  usage: python Server.py [--host HOST] [--port PORT] [--zpl-path PATH]
+                          [--zpl-filename FILENAME]
+                          [--max-message-bytes N]
+
+  The server listens on localhost only by default. Clients can call any 
+  public method, including those that load and save files on the host, so 
+  to listen on other interfaces a shared token must be set in the 
+  environment variable ZCONTROLLER_RPC_TOKEN; clients must then pass the 
+  same token to zCRPCClient.
+
+  Each message is a 4 byte (network order) length, a JSON envelope and then
+  the raw buffers of any NumPy arrays referenced by the envelope, so arrays
+  are sent in binary without pickling. The server limits the size of the
+  messages it accepts, and drops connections that do not present their
+  token within RPC_AUTH_TIMEOUT seconds. A client may send several requests
+  before reading any replies (see zCRPCClient.batch and zCRPCPipeline);
+  requests on a connection are executed, and replied to, in order.
+
+  The server can be run against any link, e.g. a zCReplayLink (see
+  Session.py) for testing without Zemax.
+'''
+import argparse
+import collections
+import hmac
+import json
+import os
+import Queue
+import socket
+import SocketServer
+import struct
+import threading
+from decimal import Decimal
+
+import numpy as np
+
+from Controller import *
+from MeritFunction import *
+
+RPC_DEFAULT_HOST = "127.0.0.1"
+RPC_DEFAULT_PORT = 8500
+RPC_TOKEN_ENV = "ZCONTROLLER_RPC_TOKEN"
+RPC_LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+# Limits on the messages accepted by the server, in bytes: the first 
+# message on a connection (the token), the JSON envelope of a request, and 
+# the total size of its array buffers (configurable, see zCRPCServer).
+#
+RPC_MAX_HELLO_BYTES = 4096
+RPC_MAX_ENVELOPE_BYTES = 16*1024*1024
+RPC_MAX_MESSAGE_BYTES = 256*1024*1024
+RPC_AUTH_TIMEOUT = 10.
+
+class RPCFunctionError(Exception):
+  def __init__(self, message, error):
+    super(Exception, self).__init__(message)
+    self.errors = error
+
+_RPC_RECORD_TYPES = {}
+
+def _decodeDtype(descr):
+  if isinstance(descr, basestring):
+    return np.dtype(str(descr))
+  fields = []
+  for field in descr:
+    if isinstance(field[1], list):
+      this_field = [str(field[0]), _decodeDtype(field[1])]
+    else:
+      this_field = [str(field[0]), str(field[1])]
+    if len(field) > 2:
+      this_field.append(tuple(field[2]))
+    fields.append(tuple(this_field))
+  return np.dtype(fields)
+
+def _encode(value, buffers):
+  '''
+    Encode [value] into a JSON serialisable object, appending the data of
+    any arrays to [buffers].
+  '''
+  if isinstance(value, zCCompactMap):
+    return {"__compact__": _encode((value.getData(), value.mask), buffers)}
+  elif isinstance(value, np.ndarray):
+    value = np.ascontiguousarray(value)
+    buffers.append(value.data)
+    if value.dtype.names is None:
+      descr = value.dtype.str
+    else:
+      descr = value.dtype.descr
+    return {"__ndarray__": len(buffers)-1, "dtype": descr,
+            "shape": value.shape}
+  elif isinstance(value, np.generic):
+    return value.item()
+  elif isinstance(value, Decimal):
+    return {"__decimal__": str(value)}
+  elif isinstance(value, tuple) and hasattr(value, "_fields"):
+    return {"__tuple__": [_encode(v, buffers) for v in value],
+            "__record__": [type(value).__name__, list(value._fields)]}
+  elif isinstance(value, tuple):
+    return {"__tuple__": [_encode(v, buffers) for v in value]}
+  elif isinstance(value, list):
+    return [_encode(v, buffers) for v in value]
+  elif isinstance(value, dict):
+    return {"__dict__": [[_encode(k, buffers), _encode(v, buffers)]
+                         for k, v in value.items()]}
+  return value
+
+def _decode(value, buffers):
+  '''
+    Inverse of _encode().
+  '''
+  if isinstance(value, list):
+    return [_decode(v, buffers) for v in value]
+  elif not isinstance(value, dict):
+    if isinstance(value, unicode):
+      try:
+        return str(value)
+      except UnicodeEncodeError:
+        return value
+    return value
+  elif "__ndarray__" in value:
+    return np.frombuffer(buffers[value["__ndarray__"]],
+                         dtype=_decodeDtype(value["dtype"])).reshape(
+                           value["shape"])
+  elif "__compact__" in value:
+    data, mask = _decode(value["__compact__"], buffers)
+    return zCCompactMap(data, dtype=data.dtype, mask=mask)
+  elif "__decimal__" in value:
+    return Decimal(value["__decimal__"])
+  elif "__record__" in value:
+    key = (str(value["__record__"][0]),
+           tuple([str(f) for f in value["__record__"][1]]))
+    if key not in _RPC_RECORD_TYPES:
+      _RPC_RECORD_TYPES[key] = collections.namedtuple(*key)
+    return _RPC_RECORD_TYPES[key](*[_decode(v, buffers)
+                                    for v in value["__tuple__"]])
+  elif "__tuple__" in value:
+    return tuple([_decode(v, buffers) for v in value["__tuple__"]])
+  elif "__dict__" in value:
+    return dict([(_decode(k, buffers), _decode(v, buffers))
+                 for k, v in value["__dict__"]])
+  return value
+
+def _recvExactly(sock, n_bytes):
+  buf = bytearray(n_bytes)
+  view = memoryview(buf)
+  received = 0
+  while received < n_bytes:
+    n = sock.recv_into(view[received:], n_bytes-received)
+    if n == 0:
+      raise EOFError("Connection closed.")
+    received += n
+  return buf
+
+def packMessage(message):
+  '''
+    Encode [message] (any value supported by _encode) into the list of 
+    strings/buffers to send. Raises an exception if it cannot be encoded, 
+    e.g. a byte string that is not valid UTF-8.
+  '''
+  buffers = []
+  envelope = _encode(message, buffers)
+  envelope = json.dumps({"MESSAGE": envelope,
+                         "BUFFERS": [len(b) for b in buffers]})
+  return [struct.pack("!I", len(envelope)) + envelope] + buffers
+
+def sendMessage(sock, message):
+  '''
+    Send [message] (any value supported by _encode) over [sock].
+  '''
+  for b in packMessage(message):
+    sock.sendall(b)
+
+def recvMessage(sock, max_envelope_bytes=None, max_buffer_bytes=None):
+  '''
+    Receive a message sent with sendMessage() from [sock].
+
+    If given, the sizes of the envelope and of all the buffers together 
+    are checked against [max_envelope_bytes] and [max_buffer_bytes] before 
+    they are received, raising RPCFunctionError if they are exceeded.
+  '''
+  n_bytes = struct.unpack("!I", str(_recvExactly(sock, 4)))[0]
+  if max_envelope_bytes is not None and n_bytes > max_envelope_bytes:
+    raise RPCFunctionError("Message envelope of " + str(n_bytes) +
+                           " bytes exceeds limit.", -1)
+  envelope = json.loads(str(_recvExactly(sock, n_bytes)))
+  sizes = envelope["BUFFERS"]
+  if not isinstance(sizes, list) or \
+    not all([isinstance(n, (int, long)) and n >= 0 for n in sizes]):
+    raise RPCFunctionError("Invalid message buffer sizes.", -1)
+  if max_buffer_bytes is not None and sum(sizes) > max_buffer_bytes:
+    raise RPCFunctionError("Message buffers of " + str(sum(sizes)) +
+                           " bytes exceed limit.", -1)
+  buffers = [_recvExactly(sock, n) for n in sizes]
+  return _decode(envelope["MESSAGE"], buffers)
+
+class _zCRPCHandler(SocketServer.BaseRequestHandler):
+  '''
+    Handle a single connection. Requests are read on a separate thread, so
+    a client pipelining many requests is never blocked from sending while
+    replies are being written.
+  '''
+  def handle(self):
+    # the first message on a connection is the client's token, which must
+    # be small and arrive within the timeout.
+    #
+    self.request.settimeout(self.server.auth_timeout)
+    try:
+      hello = recvMessage(self.request, RPC_MAX_HELLO_BYTES, 0)
+    except Exception:
+      return
+    if not self.server.isAuthorised(hello):
+      sendMessage(self.request, {"ERROR": "Invalid token."})
+      return
+    sendMessage(self.request, {"RESULT": None})
+    self.request.settimeout(None)
+
+    # the reader always ends by queueing None, whatever it fails on, so
+    # the handler never waits on a reader that has gone.
+    #
+    requests = Queue.Queue()
+    def read():
+      try:
+        while True:
+          requests.put(recvMessage(self.request, RPC_MAX_ENVELOPE_BYTES,
+                                   self.server.max_message_bytes))
+      except Exception:
+        pass
+      finally:
+        requests.put(None)
+    reader = threading.Thread(target=read)
+    reader.daemon = True
+    reader.start()
+
+    while True:
+      request = requests.get()
+      if request is None:
+        break
+      for b in self.server.execute(request):
+        self.request.sendall(b)
+
+class zCRPCServer(SocketServer.ThreadingTCPServer):
+  '''
+    Serve the public methods of a Controller, and optionally a
+    MeritFunction, for the link [zmx_link].
+
+    Calls from all connections are serialised, as the link is not thread
+    safe.
+
+    If [token] is given, clients must present the same token when they 
+    connect, within [auth_timeout] seconds. A token is required to listen 
+    on anything but localhost.
+
+    Requests whose array buffers total more than [max_message_bytes] are 
+    refused and their connection closed.
+  '''
+  allow_reuse_address = True
+  daemon_threads = True
+
+  def __init__(self, zmx_link, host=RPC_DEFAULT_HOST, port=RPC_DEFAULT_PORT,
+               mfe_zpl_path=None, mfe_zpl_filename=None, token=None,
+               max_message_bytes=RPC_MAX_MESSAGE_BYTES,
+               auth_timeout=RPC_AUTH_TIMEOUT):
+    if token is None and host not in RPC_LOOPBACK_HOSTS:
+      raise RPCFunctionError("A token is required to serve on " +
+                             repr(host) + ", set " + RPC_TOKEN_ENV + ".", -1)
+    self.token = token
+    self.max_message_bytes = max_message_bytes
+    self.auth_timeout = auth_timeout
+    SocketServer.ThreadingTCPServer.__init__(self, (host, port),
+                                             _zCRPCHandler)
+    self.zmx_link = zmx_link
+    self.lock = threading.Lock()
+    self.targets = {"Controller": Controller(zmx_link)}
+    if mfe_zpl_path is not None:
+      self.targets["MeritFunction"] = MeritFunction(zmx_link,
+                                                    self.targets["Controller"],
+                                                    mfe_zpl_path,
+                                                    mfe_zpl_filename)
+
+  def isAuthorised(self, hello):
+    if self.token is None:
+      return True
+    token = hello.get("TOKEN") if isinstance(hello, dict) else None
+    if not isinstance(token, basestring):
+      return False
+    return hmac.compare_digest(str(token), str(self.token))
+
+  def execute(self, request):
+    '''
+      Execute [request] and return the packed reply (see packMessage). 
+      Generators (e.g. the iter* methods) are run to completion and 
+      returned as lists. A result that cannot be encoded is replied to with 
+      an error, so the connection and any pipelined requests survive.
+    '''
+    if not isinstance(request, dict):
+      return packMessage({"ID": None, "ERROR": "Invalid request."})
+    reply = {"ID": request.get("ID")}
+    try:
+      target = self.targets.get(request["TARGET"])
+      if target is None or request["METHOD"].startswith("_") or \
+        not hasattr(target, request["METHOD"]):
+        raise RPCFunctionError("Unknown method " + str(request["TARGET"]) +
+                               "." + str(request["METHOD"]), -1)
+      with self.lock:
+        rtn = getattr(target, request["METHOD"])(*request["ARGS"],
+                                                 **request["KWARGS"])
+        if hasattr(rtn, "next") and hasattr(rtn, "__iter__"):
+          rtn = list(rtn)
+      reply["RESULT"] = rtn
+    except (Exception, SystemExit), e:
+      reply["ERROR"] = type(e).__name__ + ": " + str(e)
+    try:
+      return packMessage(reply)
+    except Exception, e:
+      return packMessage({"ID": reply["ID"],
+                          "ERROR": "Failed to encode reply: " +
+                          type(e).__name__ + ": " + repr(str(e))})
+
+class _zCRemoteProxy():
+  '''
+    Forward method calls on [target] to [caller].
+  '''
+  def __init__(self, caller, target):
+    self.caller = caller
+    self.target = target
+
+  def __getattr__(self, method):
+    if method.startswith("_"):
+      raise AttributeError(method)
+    def call(*args, **kwargs):
+      return self.caller(self.target, method, *args, **kwargs)
+    return call
+
+class zCRPCClient():
+  '''
+    Client for a zCRPCServer. The [controller] and [merit_function]
+    attributes have the same method names as Controller and MeritFunction,
+    each call costing one round trip. Use batch() or pipeline() to make
+    several calls for a single round trip.
+
+    [token] must match the server's token, if it has one.
+  '''
+  def __init__(self, host, port=RPC_DEFAULT_PORT, timeout=None, token=None):
+    self.sock = socket.create_connection((host, port), timeout)
+    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sendMessage(self.sock, {"TOKEN": token})
+    try:
+      reply = recvMessage(self.sock)
+    except EOFError:
+      reply = {"ERROR": "Connection closed."}
+    if "ERROR" in reply:
+      self.sock.close()
+      raise RPCFunctionError(reply["ERROR"], -1)
+    self.n_requests = 0
+    self.controller = _zCRemoteProxy(self.call, "Controller")
+    self.merit_function = _zCRemoteProxy(self.call, "MeritFunction")
+
+  def batch(self, calls):
+    '''
+      Send all [calls], a list of (target, method, args, kwargs), before
+      reading any replies. Returns the results in order.
+
+      If any call failed, RPCFunctionError is raised after all the replies
+      have been read.
+    '''
+    ids = []
+    for target, method, args, kwargs in calls:
+      self.n_requests += 1
+      ids.append(self.n_requests)
+      sendMessage(self.sock, {"ID": self.n_requests, "TARGET": target,
+                              "METHOD": method, "ARGS": list(args),
+                              "KWARGS": kwargs})
+    replies = [recvMessage(self.sock) for this_id in ids]
+    for this_id, reply in zip(ids, replies):
+      if reply["ID"] != this_id:
+        raise RPCFunctionError("Reply out of sequence.", -1)
+      if "ERROR" in reply:
+        raise RPCFunctionError(reply["ERROR"], -1)
+    return [reply["RESULT"] for reply in replies]
+
+  def call(self, target, method, *args, **kwargs):
+    return self.batch([(target, method, args, kwargs)])[0]
+
+  def close(self):
+    self.sock.close()
+
+  def pipeline(self):
+    return zCRPCPipeline(self)
+
+class zCRPCPipeline():
+  '''
+    Queue calls made through the [controller] and [merit_function]
+    attributes, each returning its index in the queue, then send them all
+    with execute(), e.g.
+
+      p = client.pipeline()
+      p.controller.getSurfaceThickness(3)
+      p.controller.getSurfaceThickness(4)
+      thick_3, thick_4 = p.execute()
+  '''
+  def __init__(self, client):
+    self.client = client
+    self.calls = []
+    self.controller = _zCRemoteProxy(self._queue, "Controller")
+    self.merit_function = _zCRemoteProxy(self._queue, "MeritFunction")
+
+  def _queue(self, target, method, *args, **kwargs):
+    self.calls.append((target, method, args, kwargs))
+    return len(self.calls)-1
+
+  def execute(self):
+    calls, self.calls = self.calls, []
+    return self.client.batch(calls)
+
+def main():
+  parser = argparse.ArgumentParser(description="Serve the Zemax controller " +
+                                   "over TCP.")
+  parser.add_argument("--host", default=RPC_DEFAULT_HOST,
+                      help="address to listen on (a token must be set in " +
+                      RPC_TOKEN_ENV + " for anything but localhost)")
+  parser.add_argument("--port", type=int, default=RPC_DEFAULT_PORT)
+  parser.add_argument("--zpl-path", default=None,
+                      help="path to the merit function macro (see " +
+                      "MeritFunction)")
+  parser.add_argument("--zpl-filename", default="DEFAULTMERIT.ZPL")
+  parser.add_argument("--max-message-bytes", type=int,
+                      default=RPC_MAX_MESSAGE_BYTES,
+                      help="largest total size of the arrays in a request")
+  args = parser.parse_args()
+
+  token = os.environ.get(RPC_TOKEN_ENV) or None
+  if token is None and args.host not in RPC_LOOPBACK_HOSTS:
+    parser.error("a token must be set in " + RPC_TOKEN_ENV + " to listen " +
+                 "on " + args.host)
+
+  import pyzdde.zdde as pyz
+  zmx_link = pyz.createLink()
+  server = zCRPCServer(zmx_link, args.host, args.port, args.zpl_path,
+                       args.zpl_filename, token, args.max_message_bytes)
+  try:
+    server.serve_forever()
+  finally:
+    server.server_close()
+    zmx_link.close()
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,204 @@
+import collections
+import cPickle as pickle
+import gzip
+import time
+
+SESSION_VERSION = 2
+
+# Methods that write a file, mapped to the (position, keyword) of the
+# filename argument. The contents are recorded so they can be served back
+# on replay.
+#
+SESSION_FILE_ARGS = {"zGetTextFile": (0, "textFileName"),
+                     "zSaveFile": (0, "fileName")}
+
+# Arguments holding (usually temporary) file paths, which differ between
+# runs and so are not compared on replay, as (position, keyword) per method.
+#
+SESSION_PATH_ARGS = {"zGetTextFile": ((0, "textFileName"),
+                                      (2, "settingsFile")),
+                     "zModifySettings": ((0, "settingsFile"),),
+                     "zSaveFile": ((0, "fileName"),)}
+
+class SessionFunctionError(Exception):
+  def __init__(self, message, error):
+    super(Exception, self).__init__(message)
+    self.errors = error
+
+class _zCRecord():
+  '''
+    A picklable stand-in for a namedtuple returned by the link, so that
+    sessions can be replayed without the link's own modules.
+  '''
+  def __init__(self, typename, fields, values):
+    self.typename = typename
+    self.fields = fields
+    self.values = values
+
+class _zCRaised():
+  '''
+    An exception raised by the link during recording.
+  '''
+  def __init__(self, typename, message):
+    self.typename = typename
+    self.message = message
+
+_RECORD_TYPES = {}
+
+def _freeze(value):
+  if isinstance(value, tuple) and hasattr(value, "_fields"):
+    return _zCRecord(type(value).__name__, tuple(value._fields),
+                     tuple([_freeze(v) for v in value]))
+  elif isinstance(value, tuple):
+    return tuple([_freeze(v) for v in value])
+  elif isinstance(value, list):
+    return [_freeze(v) for v in value]
+  return value
+
+def _thaw(value):
+  if isinstance(value, _zCRecord):
+    key = (value.typename, value.fields)
+    if key not in _RECORD_TYPES:
+      _RECORD_TYPES[key] = collections.namedtuple(*key)
+    return _RECORD_TYPES[key](*[_thaw(v) for v in value.values])
+  elif isinstance(value, tuple):
+    return tuple([_thaw(v) for v in value])
+  elif isinstance(value, list):
+    return [_thaw(v) for v in value]
+  return value
+
+def _getFileArg(name, args, kwargs):
+  position, keyword = SESSION_FILE_ARGS[name]
+  if keyword in kwargs:
+    return kwargs[keyword]
+  elif len(args) > position:
+    return args[position]
+  return None
+
+def _getCallKey(name, args, kwargs):
+  '''
+    Get the representation of a call's arguments used to match it on 
+    replay, with any paths (see SESSION_PATH_ARGS) replaced by a 
+    placeholder.
+  '''
+  args = list(args)
+  kwargs = dict(kwargs)
+  for position, keyword in SESSION_PATH_ARGS.get(name, ()):
+    if keyword in kwargs:
+      kwargs[keyword] = "<path>"
+    elif len(args) > position:
+      args[position] = "<path>"
+  return repr((tuple(args), sorted(kwargs.items())))
+
+class zCRecordingLink():
+  '''
+    A proxy for a Zemax link (e.g. pyZDDE) that records every call made
+    through it, along with its return value, latency and the contents of
+    any files it produces (see SESSION_FILE_ARGS).
+
+    Use it in place of the link, e.g. Controller(zCRecordingLink(link)),
+    then save() the session for replay with zCReplayLink.
+  '''
+  def __init__(self, zmx_link):
+    self.zmx_link = zmx_link
+    self.attributes = {}
+    self.calls = []
+
+  def __getattr__(self, name):
+    if "zmx_link" not in self.__dict__:
+      raise AttributeError(name)
+    attr = getattr(self.zmx_link, name)
+    if not callable(attr):    # e.g. constants like SDAT_THICK
+      self.attributes[name] = _freeze(attr)
+      return attr
+
+    def call(*args, **kwargs):
+      start = time.time()
+      try:
+        rtn = attr(*args, **kwargs)
+      except Exception, e:
+        self.calls.append((name, _getCallKey(name, args, kwargs),
+                           _zCRaised(type(e).__name__, str(e)),
+                           time.time()-start, None))
+        raise
+      latency = time.time()-start
+      contents = None
+      if name in SESSION_FILE_ARGS:
+        fname = _getFileArg(name, args, kwargs)
+        try:
+          with open(fname, 'rb') as f:
+            contents = f.read()
+        except (IOError, TypeError):   # no file was written
+          pass
+      self.calls.append((name, _getCallKey(name, args, kwargs), _freeze(rtn),
+                         latency, contents))
+      return rtn
+    return call
+
+  def save(self, path):
+    '''
+      Save the recorded session to a compressed file at [path].
+    '''
+    session = {"VERSION": SESSION_VERSION, "ATTRIBUTES": self.attributes,
+               "CALLS": self.calls}
+    with gzip.open(path, 'wb') as f:
+      pickle.dump(session, f, pickle.HIGHEST_PROTOCOL)
+
+class zCReplayLink():
+  '''
+    A stand-in for a Zemax link that serves back a session recorded with
+    zCRecordingLink.
+
+    Calls must be made in the same order, and with the same arguments, as 
+    they were recorded, otherwise SessionFunctionError is raised. File paths 
+    (see SESSION_PATH_ARGS) are not compared. If [strict] is False, only the 
+    method names are compared. Each call returns the recorded value after
+    sleeping for the recorded latency scaled by [latency_scale] (use 0 to
+    measure Python-side overhead only). Recorded files are written to the
+    filename given in the call.
+  '''
+  def __init__(self, path, latency_scale=1.0, strict=True):
+    with gzip.open(path, 'rb') as f:
+      session = pickle.load(f)
+    if session["VERSION"] != SESSION_VERSION:
+      raise SessionFunctionError("Unsupported session version.", -1)
+    self.attributes = session["ATTRIBUTES"]
+    self.calls = session["CALLS"]
+    self.latency_scale = latency_scale
+    self.strict = strict
+    self.n_calls = 0
+
+  def __getattr__(self, name):
+    if name in self.__dict__.get("attributes", {}):
+      return _thaw(self.attributes[name])
+    if not name.startswith("z") and not name.startswith("ipz"):
+      raise AttributeError(name)
+
+    def call(*args, **kwargs):
+      if self.n_calls >= len(self.calls):
+        raise SessionFunctionError("Session exhausted at call to " + name,
+                                   -1)
+      rec_name, rec_args, rtn, latency, contents = self.calls[self.n_calls]
+      if rec_name != name:
+        raise SessionFunctionError("Session diverged at call " +
+                                   str(self.n_calls) + ": expected " +
+                                   rec_name + ", got " + name, -1)
+      if self.strict and rec_args != _getCallKey(name, args, kwargs):
+        raise SessionFunctionError("Session diverged at call " +
+                                   str(self.n_calls) + " to " + name +
+                                   ": expected arguments " + rec_args +
+                                   ", got " + _getCallKey(name, args,
+                                                          kwargs), -1)
+      self.n_calls += 1
+      if self.latency_scale > 0:
+        time.sleep(latency*self.latency_scale)
+      if contents is not None:
+        with open(_getFileArg(name, args, kwargs), 'wb') as f:
+          f.write(contents)
+      if isinstance(rtn, _zCRaised):
+        raise SessionFunctionError(rtn.typename + ": " + rtn.message, -1)
+      return _thaw(rtn)
+    return call
+
+  def isExhausted(self):
+    return self.n_calls == len(self.calls)
@@ -0,0 +1,128 @@
+import cPickle as pickle
+import os
+import struct
+
+# Each record is a header of the lengths of the pickled key and value,
+# followed by the pickled key and then the pickled value.
+#
+STORE_HEADER = struct.Struct("!QQ")
+
+class StoreFunctionError(Exception):
+  def __init__(self, message, error):
+    super(Exception, self).__init__(message)
+    self.errors = error
+
+class zCResultStore():
+  '''
+    An append-only on-disk store of results.
+
+    Each result is written as a record of its key and value, pickled
+    separately, and flushed to disk immediately, so a run that is
+    interrupted keeps everything written up to that point. On opening an
+    existing store, only the keys are read, and a partially written
+    trailing record (e.g. from a crash mid-write) is truncated away.
+
+    Keys must be hashable. If a key is written more than once, the last
+    record wins.
+  '''
+  def __init__(self, path):
+    self.path = path
+    self.offsets = {}
+    self._scan()
+    self.fp = open(self.path, 'ab')
+    self.fp.seek(0, os.SEEK_END)
+
+  def __contains__(self, key):
+    return key in self.offsets
+
+  def __len__(self):
+    return len(self.offsets)
+
+  def _readHeader(self, f, size):
+    '''
+      Read the header of the record at the current position of [f], a
+      store of [size] bytes. Returns (key_size, value_size), or None if
+      the record is not complete.
+    '''
+    offset = f.tell()
+    if offset + STORE_HEADER.size > size:
+      return None
+    key_size, value_size = STORE_HEADER.unpack(f.read(STORE_HEADER.size))
+    if offset + STORE_HEADER.size + key_size + value_size > size:
+      return None
+    return key_size, value_size
+
+  def _scan(self):
+    '''
+      Index the records already in the store, skipping over their values.
+    '''
+    if not os.path.exists(self.path):
+      return
+    size = os.path.getsize(self.path)
+    with open(self.path, 'r+b') as f:
+      while f.tell() < size:
+        offset = f.tell()
+        sizes = self._readHeader(f, size)
+        if sizes is None:   # partially written trailing record
+          f.truncate(offset)
+          break
+        key_size, value_size = sizes
+        key = pickle.loads(f.read(key_size))
+        f.seek(value_size, os.SEEK_CUR)
+        self.offsets[key] = offset
+
+  def close(self):
+    if not self.fp.closed:
+      self.fp.close()
+
+  def get(self, key):
+    '''
+      Read the value stored for [key].
+    '''
+    try:
+      offset = self.offsets[key]
+    except KeyError:
+      raise StoreFunctionError("Key not found in store.", -1)
+    self.fp.flush()
+    with open(self.path, 'rb') as f:
+      f.seek(offset)
+      key_size, value_size = STORE_HEADER.unpack(f.read(STORE_HEADER.size))
+      f.seek(key_size, os.SEEK_CUR)
+      return pickle.loads(f.read(value_size))
+
+  def iteritems(self):
+    '''
+      Iterate over (key, value) pairs in the order they were written.
+      Only one record is held in memory at a time.
+    '''
+    self.fp.flush()
+    size = os.path.getsize(self.path)
+    with open(self.path, 'rb') as f:
+      while True:
+        offset = f.tell()
+        sizes = self._readHeader(f, size)
+        if sizes is None:
+          break
+        key_size, value_size = sizes
+        key = pickle.loads(f.read(key_size))
+        if self.offsets.get(key) == offset:
+          yield key, pickle.loads(f.read(value_size))
+        else:
+          f.seek(value_size, os.SEEK_CUR)
+
+  def keys(self):
+    return self.offsets.keys()
+
+  def put(self, key, value):
+    '''
+      Append a record for [key] and flush it to disk.
+    '''
+    offset = self.fp.tell()
+    key_data = pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+    value_data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    self.fp.write(STORE_HEADER.pack(len(key_data), len(value_data)) +
+                  key_data)
+    self.fp.write(value_data)
+    self.fp.flush()
+    os.fsync(self.fp.fileno())
+    self.offsets[key] = offset
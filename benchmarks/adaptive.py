@@ -0,0 +1,69 @@
+'''
+  Compare zCAdaptiveFieldSampler with uniform field grids on a synthetic
+  field: a smooth quartic with a narrow Gaussian feature off axis, as
+  e.g. from a vignetting edge.
+
+  usage: python benchmarks/adaptive.py [--tolerances T[,T..]]
+                                       [--uniform N[,N..]]
+                                       [--max-evaluations N] [--max-depth N]
+
+  Writes JSON with the number of samples and the maximum interpolation
+  error over a 401 x 401 grid for each adaptive tolerance and uniform grid
+  size:
+
+    {"ADAPTIVE": [{"TOLERANCE": t, "SAMPLES": n, "MAX_ERROR": e}, ..],
+     "UNIFORM": [{"N": n, "SAMPLES": n**2, "MAX_ERROR": e}, ..]}
+'''
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+  __file__))))
+
+from Adaptive import zCAdaptiveFieldSampler
+
+def getSyntheticMetric(x, y):
+  return 0.02 + 0.05*(x**2 + y**2)**2 + \
+    0.2*np.exp(-((x-0.7)**2 + (y-0.6)**2)/0.01)
+
+def evaluate(fields):
+  return [getSyntheticMetric(x, y) for x, y in fields]
+
+def getMaxError(interpolant, n_check=401):
+  x, y = np.meshgrid(np.linspace(-1, 1, n_check), np.linspace(-1, 1, n_check))
+  return float(np.abs(interpolant(x, y) - getSyntheticMetric(x, y)).max())
+
+def main():
+  parser = argparse.ArgumentParser(description="Compare adaptive and " +
+                                   "uniform field sampling.")
+  parser.add_argument("--tolerances", default="1e-2,3e-3,1e-3")
+  parser.add_argument("--uniform", default="33,65,129",
+                      help="uniform grid sizes")
+  parser.add_argument("--max-evaluations", type=int, default=5000)
+  parser.add_argument("--max-depth", type=int, default=7)
+  args = parser.parse_args()
+
+  res = {"ADAPTIVE": [], "UNIFORM": []}
+  for tolerance in [float(t) for t in args.tolerances.split(",")]:
+    sampler = zCAdaptiveFieldSampler(evaluate, (-1, 1), (-1, 1), tolerance,
+                                     max_evaluations=args.max_evaluations,
+                                     max_depth=args.max_depth)
+    fields, values, interpolant = sampler.run()
+    res["ADAPTIVE"].append({"TOLERANCE": tolerance, "SAMPLES": len(fields),
+                            "MAX_ERROR": getMaxError(interpolant)})
+  for n in [int(n) for n in args.uniform.split(",")]:
+    # an infinite tolerance never refines the initial grid.
+    #
+    sampler = zCAdaptiveFieldSampler(evaluate, (-1, 1), (-1, 1), np.inf,
+                                     n_initial=n, max_evaluations=n**2)
+    fields, values, interpolant = sampler.run()
+    res["UNIFORM"].append({"N": n, "SAMPLES": len(fields),
+                           "MAX_ERROR": getMaxError(interpolant)})
+  print json.dumps(res, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+  main()
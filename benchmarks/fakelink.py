@@ -0,0 +1,102 @@
+import collections
+import shutil
+import time
+
+from synthetic import getSyntheticFile
+
+# Constants read from the link by Controller and MeritFunction. The values
+# only need to be distinct, as the fake link does not interpret them.
+#
+FAKE_CONSTANTS = {"SDAT_TYPE": 0, "SDAT_COMMENT": 1, "SDAT_CURV": 2,
+                  "SDAT_THICK": 3, "SDAT_GLASS": 4,
+                  "SOLVE_SPAR_THICK": 0, "SOLVE_SPAR_GLASS": 1,
+                  "SOLVE_SPAR_PAR1": 5, "SOLVE_SPAR_PAR2": 6,
+                  "SOLVE_SPAR_PAR3": 7, "SOLVE_SPAR_PAR4": 8,
+                  "SOLVE_SPAR_PAR5": 9,
+                  "SOLVE_THICK_FIXED": 0, "SOLVE_THICK_VAR": 1,
+                  "SOLVE_THICK_PICKUP": 5, "SOLVE_THICK_POS": 7,
+                  "SOLVE_GLASS_PICKUP": 2, "SOLVE_PARn_PICKUP": 2,
+                  "SOLVE_PAR0_FIXED": 0, "SOLVE_PAR0_VAR": 1}
+
+# Analysis types the fake link can produce output for, mapped to the kind
+# of synthetic file and the settings keyword holding its sampling.
+#
+FAKE_ANALYSES = {"Wfm": ("WFE", "WFM_SAMP"),
+                 "Fps": ("PSF", "PSF_SAMP")}
+
+class zCFakeLink():
+  '''
+    A stand-in for a pyZDDE link that needs no Zemax, for benchmarking.
+
+    Every call is counted and sleeps for [latency] seconds, simulating the
+    round trip of a DDE call. Text analyses (see FAKE_ANALYSES) run with
+    flag=1 additionally sleep for [analysis_latency] seconds and copy a
+    synthetic output file at the requested sampling from [cache_dir] (see
+    getSyntheticFile). Any other call returns 0.
+  '''
+  def __init__(self, latency=0., analysis_latency=0., cache_dir=None):
+    self.latency = latency
+    self.analysis_latency = analysis_latency
+    self.cache_dir = cache_dir
+    self.calls = collections.Counter()
+    self.settings = {}
+    self.n_operands = 0
+
+  def __getattr__(self, name):
+    if name in FAKE_CONSTANTS:
+      return FAKE_CONSTANTS[name]
+    if not name.startswith("z") and not name.startswith("ipz"):
+      raise AttributeError(name)
+    handler = getattr(self, "_" + name, None)
+
+    def call(*args, **kwargs):
+      self.calls[name] += 1
+      if self.latency > 0:
+        time.sleep(self.latency)
+      if handler is None:
+        return 0
+      return handler(*args, **kwargs)
+    return call
+
+  def _zDeleteMFO(self, operNum):
+    self.n_operands = max(self.n_operands-1, 0)
+    return self.n_operands
+
+  def _zGetSolve(self, surfNum, code):
+    return (0, 0., 0., 0., 0.)
+
+  def _zGetSurfaceData(self, surfNum, code, arg2=None):
+    return 1.
+
+  def _zGetTextFile(self, textFileName, analysisType, settingsFile=None,
+                    flag=0, timeout=None):
+    if flag != 1 or analysisType not in FAKE_ANALYSES:
+      return 0
+    kind, sampling_keyword = FAKE_ANALYSES[analysisType]
+    sampling = self.settings.get(settingsFile, {}).get(sampling_keyword, 1)
+    if self.analysis_latency > 0:
+      time.sleep(self.analysis_latency)
+    shutil.copyfile(getSyntheticFile(kind, int(sampling), self.cache_dir),
+                    textFileName)
+    return 0
+
+  def _zGetTrace(self, waveNum, mode, surf, hx, hy, px, py):
+    # (error, vignetted, x, y, z, l, m, n, l2, m2, n2, intensity)
+    return (0, 0, 10.*hx, 10.*hy, 0., 0., 0., 1., 0., 0., 1., 1.)
+
+  def _zInsertMFO(self, operNum):
+    self.n_operands += 1
+    return self.n_operands
+
+  def _zModifySettings(self, settingsFile, mType, value):
+    self.settings.setdefault(settingsFile, {})[mType] = value
+    return 0
+
+  def getNumberOfCalls(self):
+    '''
+      Get the total number of calls made, and the number per method.
+    '''
+    return sum(self.calls.values()), dict(self.calls)
+
+  def resetCalls(self):
+    self.calls.clear()
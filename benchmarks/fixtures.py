@@ -0,0 +1,172 @@
+'''
+  Check the text analysis parsers against listings captured from Zemax.
+
+  usage: python benchmarks/fixtures.py [--fixtures-dir DIR]
+         python benchmarks/fixtures.py --capture LENS [--fixtures-dir DIR]
+                                       [--name NAME]
+
+  A fixture is a listing as written by Zemax, NAME.txt, and the values it
+  must parse to, NAME.json:
+
+    {"PARSER": "zCMtf", "DATA": [..], "HEADER": {key: value, ..}}
+
+  Only the header keys given are checked. Arrays are compared to within
+  1e-6. Exits with status 1 if any fixture fails, or if there are none, as
+  the synthetic listings of synthetic.py only follow the layouts the
+  parsers expect and are no check of them against Zemax.
+
+  With --capture, the analyses in FIXTURE_ANALYSES are run with their
+  default settings for LENS on a Zemax host (this needs pyZDDE), and each
+  listing is saved with the values it currently parses to. These values
+  must be checked by hand against the analysis windows in Zemax before the
+  fixture is committed.
+'''
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from decimal import Decimal
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import Parser
+
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, "fixtures")
+
+# Analyses captured, as (fixture name suffix, Zemax analysis type, parser).
+#
+FIXTURE_ANALYSES = [("wfe", "Wfm", "zCWFE"), ("psf", "Fps", "zCFFftPsf"),
+                    ("mtf", "Mtf", "zCMtf"),
+                    ("encircled_energy", "Enc", "zCEncircledEnergy"),
+                    ("spot", "Spt", "zCSpot"), ("zernike", "Zfr", "zCZernike")]
+
+def _toJSON(value):
+  '''
+    Convert a parsed value into a JSON serialisable object.
+  '''
+  if isinstance(value, np.ndarray):
+    return value.tolist()
+  elif isinstance(value, (np.generic, Decimal)):
+    return float(value)
+  elif isinstance(value, (list, tuple)):
+    return [_toJSON(v) for v in value]
+  elif isinstance(value, dict):
+    return dict([(k, _toJSON(v)) for k, v in value.items()])
+  return value
+
+def _isSame(parsed, expected):
+  parsed = _toJSON(parsed)
+  if isinstance(expected, list):
+    try:
+      return np.shape(parsed) == np.shape(expected) and \
+        np.allclose(np.array(parsed, dtype=float),
+                    np.array(expected, dtype=float), atol=1e-6)
+    except (TypeError, ValueError):
+      return parsed == expected
+  elif isinstance(expected, float) and isinstance(parsed, (int, float)):
+    return abs(parsed - expected) <= 1e-6
+  return parsed == expected
+
+def parseListing(fname, parser):
+  '''
+    Parse the listing [fname] with the Parser class named [parser]. Returns
+    the data and header, or None if it fails to parse.
+  '''
+  this_parser = getattr(Parser, parser)(fname, verbose=False)
+  if not this_parser.parse():
+    return None
+  return this_parser.getData(), this_parser.getHeader()
+
+def checkFixture(fname):
+  '''
+    Check the listing [fname] against its expected values. Returns a list
+    of the keys that differ ("PARSE" if it fails to parse).
+  '''
+  with open(os.path.splitext(fname)[0] + ".json") as f:
+    expected = json.load(f)
+  parsed = parseListing(fname, str(expected["PARSER"]))
+  if parsed is None:
+    return ["PARSE"]
+  data, header = parsed
+  differs = []
+  if "DATA" in expected and not _isSame(data, expected["DATA"]):
+    differs.append("DATA")
+  for key, value in expected.get("HEADER", {}).items():
+    if not _isSame(header.get(str(key)), value):
+      differs.append(key)
+  return differs
+
+def captureFixtures(lens, fixtures_dir, name):
+  '''
+    Run FIXTURE_ANALYSES for [lens] and save each listing, and the values
+    it parses to, in [fixtures_dir] as [name]_<analysis>.
+  '''
+  import pyzdde.zdde as pyz
+  link = pyz.createLink()
+  scratch_dir = tempfile.mkdtemp()
+  try:
+    if link.zLoadFile(os.path.abspath(lens)) != 0:
+      raise IOError("Failed to load " + lens)
+    for suffix, analysis_type, parser in FIXTURE_ANALYSES:
+      fname = os.path.join(scratch_dir, suffix + ".txt")
+      if link.zGetTextFile(fname, analysis_type) != 0:
+        print "Failed to run " + analysis_type + " for " + lens
+        continue
+      fixture = os.path.join(fixtures_dir, name + "_" + suffix)
+      shutil.copyfile(fname, fixture + ".txt")
+      parsed = parseListing(fname, parser)
+      expected = {"PARSER": parser}
+      if parsed is not None:
+        expected["DATA"] = _toJSON(parsed[0])
+        expected["HEADER"] = _toJSON(parsed[1])
+      with open(fixture + ".json", 'w') as f:
+        json.dump(expected, f, indent=2, sort_keys=True)
+      print "Captured " + fixture + ".txt" + \
+        ("" if parsed is not None else " (failed to parse)")
+  finally:
+    link.close()
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+
+def main():
+  parser = argparse.ArgumentParser(description="Check the parsers against " +
+                                   "listings captured from Zemax.")
+  parser.add_argument("--fixtures-dir", default=FIXTURES_DIR)
+  parser.add_argument("--capture", default=None, metavar="LENS",
+                      help="capture fixtures for this lens file (needs " +
+                      "Zemax)")
+  parser.add_argument("--name", default=None,
+                      help="name of the captured fixtures (default: the " +
+                      "lens file name)")
+  args = parser.parse_args()
+
+  if args.capture is not None:
+    if not os.path.exists(args.fixtures_dir):
+      os.makedirs(args.fixtures_dir)
+    name = args.name or os.path.splitext(os.path.basename(args.capture))[0]
+    captureFixtures(args.capture, args.fixtures_dir, name)
+    return
+
+  fnames = []
+  if os.path.isdir(args.fixtures_dir):
+    fnames = sorted([os.path.join(args.fixtures_dir, f)
+                     for f in os.listdir(args.fixtures_dir)
+                     if f.endswith(".txt")])
+  if len(fnames) == 0:
+    print "No fixtures found in " + args.fixtures_dir + "."
+    sys.exit(1)
+  failed = False
+  for fname in fnames:
+    differs = checkFixture(fname)
+    print os.path.basename(fname) + ": " + \
+      ("ok" if not differs else "differs in " + ", ".join(differs))
+    failed = failed or len(differs) > 0
+  if failed:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,308 @@
+'''
+  Benchmark the Controller, MeritFunction and Parser hot paths without
+  Zemax, against zCFakeLink (see fakelink.py) and synthetic UTF-16 output
+  files (see synthetic.py).
+
+  usage: python benchmarks/run.py [--latency SECONDS]
+                                  [--analysis-latency SECONDS]
+                                  [--repeats N] [--max-sampling N]
+                                  [--cases NAME[,NAME..]] [--output FILE]
+                                  [--cache-dir DIR] [--list]
+
+  Each case is run in its own Python process, so that its peak memory
+  (ru_maxrss, kB on Linux) is not inflated by earlier cases. Results are
+  written as JSON:
+
+    {"CONFIG": {..},
+     "IMPORT": {module: {"MIN": s, "MEDIAN": s}, ..},
+     "CASES": {case: {"WALL": {"MIN": s, "MEDIAN": s, "MEAN": s},
+                      "REPEATS": n,
+                      "DDE_CALLS": n, "DDE_CALLS_BY_METHOD": {..},
+                      "BASE_RSS_KB": kB, "PEAK_RSS_KB": kB}, ..}}
+
+  DDE call counts are per repeat. BASE_RSS_KB is the peak after imports
+  and setup, before the case is run. Import times are measured in fresh
+  processes; Parser is included as it imports pylab.
+'''
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from fakelink import zCFakeLink
+from synthetic import SYNTHETIC_LISTINGS, checkSyntheticParse, \
+  getSyntheticFile
+
+# Parsers benchmarked, mapped to the kind of synthetic listing they parse
+# and whether to parse it at every sampling.
+#
+BENCHMARK_PARSERS = [("zCWFE", "WFE", True), ("zCFFftPsf", "PSF", True),
+                     ("zCMtf", "MTF", True), ("zCEncircledEnergy", "EE", True),
+                     ("zCSpot", "SPOT", False), ("zCZernike", "ZERNIKE", False)]
+
+BENCHMARK_IMPORT_MODULES = ("numpy", "pylab", "Parser", "Controller",
+                            "MeritFunction")
+
+class BenchmarkFunctionError(Exception):
+  def __init__(self, message, error):
+    super(Exception, self).__init__(message)
+    self.errors = error
+
+def getFields(n_fields, max_field=1.):
+  '''
+    Get [n_fields] fields (x, y) on a square grid out to [max_field],
+    row by row.
+  '''
+  n_side = int(np.ceil(np.sqrt(n_fields)))
+  values = np.linspace(-max_field, max_field, n_side)
+  return [(x, y) for y in values for x in values][:n_fields]
+
+# Cases. Each takes the parsed options and returns a function of the link
+# that runs the case once; anything done before returning is setup and is
+# not timed.
+#
+def _caseParse(parser, kind, sampling):
+  def case(options):
+    import Parser
+    fname = getSyntheticFile(kind, sampling, options.cache_dir)
+    cls = getattr(Parser, parser)
+
+    # check the parsed values against those written before timing.
+    #
+    if kind in SYNTHETIC_LISTINGS:
+      this_parser = cls(fname, verbose=False)
+      if not this_parser.parse():
+        raise BenchmarkFunctionError("Failed to parse " + fname, -1)
+      differs = checkSyntheticParse(kind, sampling, this_parser.getData(),
+                                    this_parser.getHeader())
+      if differs:
+        raise BenchmarkFunctionError("Parsed " + ", ".join(differs) +
+                                     " differ from " + fname, -1)
+    def run(link):
+      if not cls(fname, verbose=False).parse():
+        raise BenchmarkFunctionError("Failed to parse " + fname, -1)
+    return run
+  return case
+
+def _caseSetFieldsTable(options):
+  from Controller import Controller
+  fields = getFields(12)
+  def run(link):
+    Controller(link).setFieldsTable(fields, field_type=0)
+  return run
+
+def _caseRayTraceForFields(options):
+  from Controller import Controller
+  fields = getFields(options.n_fields)
+  def run(link):
+    Controller(link).doRayTraceForFields(fields, field_type=0)
+  return run
+
+def _caseWFEForFields(options):
+  from Controller import Controller
+  fields = getFields(options.n_wfe_fields)
+  getSyntheticFile("WFE", options.wfe_sampling, options.cache_dir)
+  def run(link):
+    data, headers = Controller(link).getAnalysisWFEForFields(fields, 0,
+                      sampling=options.wfe_sampling)
+    if len(data) != len(fields):
+      raise BenchmarkFunctionError("Failed to get WFE maps.", -1)
+  return run
+
+def _caseTiltAndDecentreAboutPivot(options):
+  from Controller import Controller
+  def run(link):
+    Controller(link).addTiltAndDecentreAboutPivot(2, 5, pivot_z=10.,
+                                                  x_c=0.1, y_c=0.1,
+                                                  x_tilt=0.5, y_tilt=0.5)
+  return run
+
+def _caseTiltsAndDecentresAboutPivots(options):
+  from Controller import Controller
+  specs = [(2+4*i, 4+4*i, 10., 0.1, 0.1, 0.5, 0.5) for i in range(4)]
+  def run(link):
+    Controller(link).addTiltsAndDecentresAboutPivots(specs)
+  return run
+
+def _caseAirGapConstraints(options):
+  from Controller import Controller
+  from MeritFunction import MeritFunction
+  def run(link):
+    mf = MeritFunction(link, Controller(link), "", "DEFAULTMERIT.ZPL")
+    for surf in range(2, 12):
+      mf.setAirGapConstraints(1, surf, 0.5, 5.)
+  return run
+
+def getCases(max_sampling):
+  '''
+    Get the cases as a list of (name, case), parsing at samplings 1 to
+    [max_sampling].
+  '''
+  cases = []
+  for parser, kind, per_sampling in BENCHMARK_PARSERS:
+    samplings = range(1, max_sampling+1) if per_sampling else [1]
+    for sampling in samplings:
+      cases.append(("parse/%s/%d" % (parser, sampling),
+                    _caseParse(parser, kind, sampling)))
+  cases += [("Controller.setFieldsTable", _caseSetFieldsTable),
+            ("Controller.doRayTraceForFields", _caseRayTraceForFields),
+            ("Controller.getAnalysisWFEForFields", _caseWFEForFields),
+            ("Controller.addTiltAndDecentreAboutPivot",
+             _caseTiltAndDecentreAboutPivot),
+            ("Controller.addTiltsAndDecentresAboutPivots",
+             _caseTiltsAndDecentresAboutPivots),
+            ("MeritFunction.setAirGapConstraints", _caseAirGapConstraints)]
+  return cases
+
+def _getPeakRSS():
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _getSummary(values):
+  return {"MIN": float(np.min(values)), "MEDIAN": float(np.median(values)),
+          "MEAN": float(np.mean(values))}
+
+def runCase(name, options):
+  '''
+    Run case [name] [options.repeats] times in this process.
+  '''
+  cases = dict(getCases(options.max_sampling))
+  if name not in cases:
+    raise BenchmarkFunctionError("Unknown case " + name, -1)
+
+  run = cases[name](options)
+  base_rss = _getPeakRSS()
+  walls = []
+  for i in range(options.repeats):
+    link = zCFakeLink(options.latency, options.analysis_latency,
+                      options.cache_dir)
+    gc.collect()
+    start = time.time()
+    run(link)
+    walls.append(time.time()-start)
+    n_calls, calls_by_method = link.getNumberOfCalls()
+
+  return {"WALL": _getSummary(walls), "REPEATS": options.repeats,
+          "DDE_CALLS": n_calls, "DDE_CALLS_BY_METHOD": calls_by_method,
+          "BASE_RSS_KB": base_rss, "PEAK_RSS_KB": _getPeakRSS()}
+
+def writeSyntheticFiles(options):
+  '''
+    Write the synthetic files needed by the cases up front, so their
+    generation does not count towards any case's memory.
+  '''
+  for parser, kind, per_sampling in BENCHMARK_PARSERS:
+    samplings = range(1, options.max_sampling+1) if per_sampling else [1]
+    for sampling in samplings:
+      getSyntheticFile(kind, sampling, options.cache_dir)
+  getSyntheticFile("WFE", options.wfe_sampling, options.cache_dir)
+
+def runCaseInProcess(name, options):
+  '''
+    Run case [name] in a fresh Python process (see runCase()).
+  '''
+  cmd = [sys.executable, os.path.abspath(__file__), "--run-case", name,
+         "--latency", repr(options.latency),
+         "--analysis-latency", repr(options.analysis_latency),
+         "--repeats", str(options.repeats),
+         "--max-sampling", str(options.max_sampling),
+         "--n-fields", str(options.n_fields),
+         "--n-wfe-fields", str(options.n_wfe_fields),
+         "--wfe-sampling", str(options.wfe_sampling),
+         "--cache-dir", options.cache_dir]
+  proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, cwd=REPO_DIR)
+  out = proc.communicate()[0]
+  if proc.returncode != 0:
+    raise BenchmarkFunctionError("Case " + name + " failed.", -1)
+  return json.loads(out.strip().splitlines()[-1])   # after any warnings
+
+def getImportTimes(modules=BENCHMARK_IMPORT_MODULES, repeats=5):
+  '''
+    Time importing each of [modules] in a fresh Python process, [repeats]
+    times.
+  '''
+  res = {}
+  for module in modules:
+    times = []
+    for i in range(repeats):
+      out = subprocess.check_output([sys.executable, "-c",
+        "import time; start = time.time(); import " + module + "; " +
+        "print repr(time.time()-start)"], cwd=REPO_DIR)
+      times.append(float(out.strip().splitlines()[-1]))
+    summary = _getSummary(times)
+    del summary["MEAN"]
+    res[module] = summary
+  return res
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark the Zemax " +
+                                   "controller against a fake link.")
+  parser.add_argument("--latency", type=float, default=0.,
+                      help="seconds per DDE call")
+  parser.add_argument("--analysis-latency", type=float, default=0.,
+                      help="extra seconds per text analysis")
+  parser.add_argument("--repeats", type=int, default=5)
+  parser.add_argument("--max-sampling", type=int, default=4,
+                      help="largest sampling to parse (1 = 32 x 32)")
+  parser.add_argument("--n-fields", type=int, default=100,
+                      help="fields to ray trace")
+  parser.add_argument("--n-wfe-fields", type=int, default=25,
+                      help="fields to get WFE maps for")
+  parser.add_argument("--wfe-sampling", type=int, default=2)
+  parser.add_argument("--cases", default=None,
+                      help="comma separated case names (default: all)")
+  parser.add_argument("--cache-dir", default=os.path.join(
+                      tempfile.gettempdir(), "zController-benchmarks"),
+                      help="directory for the synthetic output files")
+  parser.add_argument("--output", default=None,
+                      help="file to write the JSON results to (default: " +
+                      "stdout)")
+  parser.add_argument("--list", action="store_true",
+                      help="list the case names and exit")
+  parser.add_argument("--run-case", default=None, help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.run_case is not None:
+    print json.dumps(runCase(args.run_case, args))
+    return
+
+  names = [name for name, case in getCases(args.max_sampling)]
+  if args.list:
+    print "\n".join(names)
+    return
+  if args.cases is not None:
+    names = args.cases.split(",")
+
+  res = {"CONFIG": {"LATENCY": args.latency,
+                    "ANALYSIS_LATENCY": args.analysis_latency,
+                    "REPEATS": args.repeats,
+                    "MAX_SAMPLING": args.max_sampling,
+                    "N_FIELDS": args.n_fields,
+                    "N_WFE_FIELDS": args.n_wfe_fields,
+                    "WFE_SAMPLING": args.wfe_sampling,
+                    "PYTHON": sys.version.split()[0],
+                    "NUMPY": np.__version__},
+         "IMPORT": getImportTimes(),
+         "CASES": {}}
+  writeSyntheticFiles(args)
+  for name in names:
+    res["CASES"][name] = runCaseInProcess(name, args)
+
+  if args.output is None:
+    print json.dumps(res, indent=2, sort_keys=True)
+  else:
+    with open(args.output, 'w') as f:
+      json.dump(res, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,257 @@
+import codecs
+import os
+import tempfile
+
+import numpy as np
+
+SYNTHETIC_SEED = 0
+
+def getSamplingSize(sampling):
+  '''
+    Get the grid size for the 1 indexed Zemax [sampling], i.e. 1 = 32 x 32,
+    2 = 64 x 64, ..
+  '''
+  return 32 * 2**(sampling-1)
+
+def _writeListing(fname, header, data, fmt):
+  '''
+    Write [header] lines followed by [data] as a UTF-16 text file with
+    Windows line endings, as Zemax does.
+  '''
+  lines = header + [u"\t".join([fmt % v for v in row]) for row in data]
+  with codecs.open(fname, 'w', "UTF-16-LE") as f:
+    f.write(u"\r\n".join(lines) + u"\r\n")
+
+def writeWFE(fname, sampling, seed=SYNTHETIC_SEED):
+  '''
+    Write a synthetic wavefront map listing (see Parser.zCWFE) at
+    [sampling]: defocus, astigmatism and noise inside the pupil, zero
+    outside it.
+  '''
+  n = getSamplingSize(sampling)
+  y, x = (np.mgrid[0:n, 0:n] - n/2) / (n/2.)
+  r2 = x**2 + y**2
+  noise = np.random.RandomState(seed).randn(n, n)
+  data = 0.05*(2*r2-1) + 0.02*(x**2-y**2) + 0.001*noise
+  data[r2 > 1] = 0.
+  rms = data[r2 <= 1].std()
+  p2v = data[r2 <= 1].ptp()
+  header = [u"Listing of Wavefront Map Data", u"",
+            u"File : synthetic.zmx", u"Title: synthetic",
+            u"Date : 01/01/2000", u"", u"", u"",
+            u"0.6328 \xb5m at 0.0000, 1.0000 (deg).",
+            u"Peak to valley = %.4f waves, RMS = %.4f waves." % (p2v, rms),
+            u"Surface: Image",
+            u"Exit Pupil Diameter: 1.0000E+01 Millimeters",
+            u"",
+            u"Pupil grid size: %d by %d" % (n, n),
+            u"Center point is: row %d, column %d" % (n/2+1, n/2+1),
+            u""]
+  _writeListing(fname, header, data, "%.6E")
+
+def writePSF(fname, sampling, seed=SYNTHETIC_SEED):
+  '''
+    Write a synthetic FFT PSF listing (see Parser.zCFFftPsf) at [sampling]
+    with equal pupil and image grids: a Gaussian core and noise.
+  '''
+  n = getSamplingSize(sampling)
+  y, x = (np.mgrid[0:n, 0:n] - n/2)
+  noise = np.random.RandomState(seed).rand(n, n)
+  data = np.exp(-(x**2 + y**2)/8.) + 1e-4*noise
+  data /= data.max()
+  header = [u"Listing of FFT PSF Data", u"",
+            u"File : synthetic.zmx", u"Title: synthetic",
+            u"Date : 01/01/2000", u"", u"", u"",
+            u"0.6328 \xb5m at 0.0000, 1.0000 (deg).",
+            u"Data spacing is 0.500 \xb5m.",
+            u"Data area is %.3f \xb5m wide." % (n*0.5),
+            u"Strehl ratio: 0.950",
+            u"Normalized",
+            u"Pupil grid size: %d by %d" % (n, n),
+            u"Image grid size: %d by %d" % (n, n),
+            u"Center point is: row %d, column %d" % (n/2+1, n/2+1),
+            u"Values are relative intensity.",
+            u""]
+  _writeListing(fname, header, data, "%.4E")
+
+# The listings below follow the layouts the parsers expect, so that the
+# benchmarks time a successful parse; they are not a check of the parsers
+# against Zemax, for which see fixtures.py.
+#
+_SYNTHETIC_PREAMBLE = [u"", u"File : synthetic.zmx", u"Title: synthetic",
+                       u"Date : 01/01/2000", u""]
+
+# Fields listed in the MTF, encircled energy and spot listings, given in
+# object height (mm) so that their unit differs from that of the data.
+#
+SYNTHETIC_FIELDS = [(0., 0.), (0., 5.), (0., 10.)]
+
+def getMTFListing(sampling, seed=SYNTHETIC_SEED):
+  '''
+    Get the lines of a synthetic FFT MTF listing (see Parser.zCMtf) with a 
+    diffraction limit table and one table per field in SYNTHETIC_FIELDS, 
+    each of getSamplingSize([sampling]) frequencies, and the expected data 
+    and header values.
+  '''
+  n = getSamplingSize(sampling)
+  nu = np.linspace(0, 1, n)
+  limit = 2/np.pi*(np.arccos(nu) - nu*np.sqrt(1-nu**2))
+  rs = np.random.RandomState(seed)
+  tables = []
+  for idx in range(len(SYNTHETIC_FIELDS)):
+    damping = np.exp(-(idx+1)*nu*rs.uniform(0.5, 1., 2)[:, np.newaxis])
+    tables.append(np.vstack([nu*100., limit*damping[0], limit*damping[1]]).T)
+  limit = np.vstack([nu*100., limit, limit]).T
+
+  lines = [u"Listing of Polychromatic FFT MTF Data"] + _SYNTHETIC_PREAMBLE
+  lines += [u"Data for 0.4861 to 0.6563 \xb5m.",
+            u"Spatial frequency in cycles per mm.", u"Surface: Image", u""]
+  columns = u"Spatial frequency\tTangential\tSagittal"
+  for heading, table in [(u"Diffraction Limit", limit)] + \
+    [(u"Field: %.4f, %.4f (mm)" % f, t)
+     for f, t in zip(SYNTHETIC_FIELDS, tables)]:
+    lines += [heading, columns]
+    lines += [u"\t".join([u"%.6f" % v for v in row]) for row in table]
+    lines += [u""]
+  return lines, {"DATA": np.array(tables), "FIELDS": SYNTHETIC_FIELDS,
+                 "FREQUENCY_UNIT": "mm", "DIFFRACTION_LIMIT": limit}
+
+def getEncircledEnergyListing(sampling, seed=SYNTHETIC_SEED):
+  '''
+    Get the lines of a synthetic diffraction encircled energy listing (see 
+    Parser.zCEncircledEnergy) with getSamplingSize([sampling]) radii, and 
+    the expected data and header values.
+  '''
+  n = getSamplingSize(sampling)
+  r = np.linspace(0, 20., n)
+  widths = [2.] + [2.+(idx+1)*np.random.RandomState(seed+idx).uniform()
+                   for idx in range(len(SYNTHETIC_FIELDS))]
+  data = np.vstack([r] + [1-np.exp(-(r/w)**2) for w in widths]).T
+
+  lines = [u"Listing of Diffraction Encircled Energy Data"]
+  lines += _SYNTHETIC_PREAMBLE
+  lines += [u"Wavelength: Polychromatic", u"Reference: Chief Ray"]
+  lines += [u"Field %d: %.4f, %.4f (mm)" % ((idx+1,) + f)
+            for idx, f in enumerate(SYNTHETIC_FIELDS)]
+  lines += [u"", u"Radius (\xb5m)\tDiff. Limit\t" +
+            u"\t".join([u"Field %d" % (idx+1)
+                        for idx in range(len(SYNTHETIC_FIELDS))])]
+  lines += [u"\t".join([u"%.6f" % v for v in row]) for row in data]
+  return lines, {"DATA": np.round(data, 6), "RADIUS_UNIT": u"\xb5m"}
+
+def getSpotListing(sampling, seed=SYNTHETIC_SEED):
+  '''
+    Get the lines of a synthetic spot diagram listing (see Parser.zCSpot) 
+    for SYNTHETIC_FIELDS, and the expected data and header values. 
+    [sampling] is unused.
+  '''
+  rms = np.round(np.random.RandomState(seed).uniform(1, 10,
+                                                      len(SYNTHETIC_FIELDS)),
+                 3)
+  geo = np.round(rms*2.5, 3)
+  n = len(SYNTHETIC_FIELDS)
+  lines = [u"Listing of Spot Diagram Data"] + _SYNTHETIC_PREAMBLE
+  lines += [u"Surface: Image",
+            u"Field coordinates are in (mm).",
+            u"Airy Radius : 3.456 \xb5m",
+            u"Units are \xb5m.",
+            u"Field       : " + u" ".join([u"%10d" % (i+1) for i in range(n)]),
+            u"RMS radius  : " + u" ".join([u"%10.3f" % v for v in rms]),
+            u"GEO radius  : " + u" ".join([u"%10.3f" % v for v in geo]),
+            u"Scale bar   : 100     Reference : Chief Ray"]
+  return lines, {"DATA": np.vstack([rms, geo]).T, "RADIUS_UNIT": u"\xb5m"}
+
+def getZernikeListing(sampling, seed=SYNTHETIC_SEED):
+  '''
+    Get the lines of a synthetic Zernike fringe coefficient listing (see 
+    Parser.zCZernike) with 37 terms, and the expected data and header 
+    values. [sampling] is unused.
+  '''
+  coeffs = np.round(np.random.RandomState(seed).randn(37)*0.01, 8)
+  labels = [(u"Using Zernike Fringe polynomials.", None),
+            (u"Surface", u"Image"),
+            (u"Field", u"0.0000, 10.0000 (mm)"),
+            (u"Wavelength", u"0.5876 \xb5m"),
+            (u"Peak to Valley (to chief)", u"0.12345678 waves"),
+            (u"Peak to Valley (to centroid)", u"0.11345678 waves"),
+            (u"", None),
+            (u"From integration of the rays:", None),
+            (u"RMS (to chief)", u"0.03456789 waves"),
+            (u"RMS (to centroid)", u"0.03356789 waves"),
+            (u"Variance", u"0.00112680 waves squared"),
+            (u"Strehl Ratio (Est)", u"0.95647000"),
+            (u"", None),
+            (u"From integration of the fitted coefficients:", None),
+            (u"RMS (to chief)", u"0.03450000 waves"),
+            (u"RMS (to centroid)", u"0.03350000 waves"),
+            (u"Variance", u"0.00112225 waves squared"),
+            (u"Strehl Ratio (Est)", u"0.95665000"),
+            (u"", None),
+            (u"RMS fit error", u"0.00001234 waves"),
+            (u"Maximum fit error", u"0.00004567 waves"),
+            (u"", None)]
+  lines = [u"Listing of Zernike Fringe Coefficient Data"]
+  lines += _SYNTHETIC_PREAMBLE
+  for label, value in labels:
+    if value is None:
+      lines.append(label)
+    else:
+      lines.append(u"%-48s: %s" % (label, value))
+  lines += [u"Z %3d %14.8f : term %d" % (idx+1, c, idx+1)
+            for idx, c in enumerate(coeffs)]
+  return lines, {"DATA": coeffs, "P2V_CHIEF": 0.12345678,
+                 "RMS_CHIEF": 0.03456789, "RMS_CENTROID": 0.03356789,
+                 "STREHL": 0.95647}
+
+SYNTHETIC_LISTINGS = {"MTF": getMTFListing, "EE": getEncircledEnergyListing,
+                      "SPOT": getSpotListing, "ZERNIKE": getZernikeListing}
+
+def _writeSyntheticListing(kind):
+  def write(fname, sampling, seed=SYNTHETIC_SEED):
+    lines, expected = SYNTHETIC_LISTINGS[kind](sampling, seed)
+    with codecs.open(fname, 'w', "UTF-16-LE") as f:
+      f.write(u"\r\n".join(lines) + u"\r\n")
+  return write
+
+SYNTHETIC_WRITERS = {"WFE": writeWFE, "PSF": writePSF}
+for kind in SYNTHETIC_LISTINGS:
+  SYNTHETIC_WRITERS[kind] = _writeSyntheticListing(kind)
+
+def checkSyntheticParse(kind, sampling, data, header):
+  '''
+    Check the parsed [data] and [header] of a synthetic [kind] listing 
+    (see SYNTHETIC_LISTINGS) at [sampling] against the values written. 
+    Returns a list of the keys that differ.
+  '''
+  lines, expected = SYNTHETIC_LISTINGS[kind](sampling)
+  differs = []
+  for key, value in expected.items():
+    if key == "DATA":
+      parsed = data
+    else:
+      parsed = header.get(key)
+    if isinstance(value, np.ndarray):
+      same = parsed is not None and np.shape(parsed) == value.shape and \
+        np.allclose(parsed, value, atol=1e-6)
+    else:
+      same = parsed == value
+    if not same:
+      differs.append(key)
+  return differs
+
+def getSyntheticFile(kind, sampling, cache_dir=None):
+  '''
+    Get the path of a synthetic [kind] (see SYNTHETIC_WRITERS) listing at
+    [sampling], writing it to [cache_dir] (default: a directory in the
+    system temporary directory) if it does not exist yet.
+  '''
+  if cache_dir is None:
+    cache_dir = os.path.join(tempfile.gettempdir(), "zController-benchmarks")
+  if not os.path.exists(cache_dir):
+    os.makedirs(cache_dir)
+  fname = os.path.join(cache_dir, "%s_%d.txt" % (kind, sampling))
+  if not os.path.exists(fname):
+    tmp_fname = fname + ".tmp"
+    SYNTHETIC_WRITERS[kind](tmp_fname, sampling)
+    os.rename(tmp_fname, fname)
+  return fname